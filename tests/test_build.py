@@ -0,0 +1,329 @@
+"""Incremental builds of tool/format.py: manifest reuse, invalidation and
+the files written next to the pages."""
+
+import contextlib
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tool'))
+
+import format  # noqa: E402
+
+SOURCES = {
+    'index.md': '# Home\n\nWelcome.\n',
+    'a/index.md': '# Page A\n\nFirst page.\n',
+    'b/index.md': '# Page B\n\nSecond page.\n',
+}
+
+
+class BuildTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='build-')
+        for key, text in SOURCES.items():
+            self.write(key, text)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, rel):
+        return os.path.join(self.root, rel)
+
+    def write(self, rel, text):
+        os.makedirs(os.path.dirname(self.path(rel)), exist_ok=True)
+        with open(self.path(rel), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def read(self, rel):
+        with open(self.path(rel), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def build(self, force=False, include=(), exclude=(), prune=False, **options):
+        # -> the build's output; the tool directory itself need not exist
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            failed = format.process_all_markdown_files(
+                self.path('tool'), force=force, options=format.BuildOptions(**options),
+                include=include, exclude=exclude, prune=prune)
+        self.assertEqual(failed, [], out.getvalue())
+        return out.getvalue()
+
+    def manifest(self):
+        return format.load_manifest(self.root)
+
+    def converted(self, output):
+        return sorted(os.path.relpath(line.split(' -> ')[0].split(': ', 1)[1], self.root)
+                      for line in output.splitlines() if line.startswith('已转换: '))
+
+
+class IncrementalBuildTest(BuildTestCase):
+
+    def mtimes(self):
+        return {key: os.stat(self.path(key.replace('.md', '.html'))).st_mtime_ns for key in SOURCES}
+
+    def test_first_build_then_no_op(self):
+        self.assertEqual(self.converted(self.build()), sorted(SOURCES))
+        files = self.manifest()['files']
+        self.assertEqual(sorted(files), sorted(SOURCES))
+        for key, entry in files.items():
+            self.assertEqual(entry['source'], format.file_hash(self.path(key)))
+            self.assertEqual(entry['output'], format.file_hash(self.path(key.replace('.md', '.html'))))
+        self.assertIn('Page A', self.read('a/index.html'))
+
+        before = self.mtimes()
+        output = self.build()
+        self.assertEqual(self.converted(output), [])
+        self.assertIn('未变化，已跳过 3 个文件', output)
+        self.assertEqual(self.mtimes(), before)
+        self.assertEqual(self.manifest()['files'], files)
+
+    def test_edit(self):
+        self.build()
+        files = self.manifest()['files']
+        self.write('a/index.md', '# Page A\n\nEdited.\n')
+        self.assertEqual(self.converted(self.build()), ['a/index.md'])
+        self.assertIn('Edited.', self.read('a/index.html'))
+        after = self.manifest()['files']
+        self.assertEqual(after['a/index.md']['source'], format.file_hash(self.path('a/index.md')))
+        self.assertNotEqual(after['a/index.md']['output'], files['a/index.md']['output'])
+        self.assertEqual(after['b/index.md'], files['b/index.md'])
+
+        # the same bytes again (a touch, a checkout) are not an edit
+        self.write('b/index.md', SOURCES['b/index.md'])
+        self.assertEqual(self.converted(self.build()), [])
+
+    def test_missing_output_is_rebuilt(self):
+        self.build()
+        os.remove(self.path('b/index.html'))
+        self.assertEqual(self.converted(self.build()), ['b/index.md'])
+        self.assertTrue(os.path.exists(self.path('b/index.html')))
+
+    def test_force(self):
+        self.build()
+        files = self.manifest()['files']
+        before = self.mtimes()
+        output = self.build(force=True)
+        self.assertEqual(self.converted(output), sorted(SOURCES))
+        # same bytes: rendered again but not written
+        self.assertEqual(output.count('(内容相同，未写入)'), 3)
+        self.assertEqual(self.mtimes(), before)
+        self.assertEqual(self.manifest()['files'], files)
+
+    def test_option_change(self):
+        self.build()
+        config = self.manifest()['config']
+        self.assertEqual(self.converted(self.build(minify=True)), sorted(SOURCES))
+        self.assertNotEqual(self.manifest()['config'], config)
+        self.assertEqual(self.converted(self.build(minify=True)), [])
+        # back to the old options is a change as well
+        self.assertEqual(self.converted(self.build()), sorted(SOURCES))
+
+    def test_template_change(self):
+        self.build()
+        with mock.patch.object(format, 'SITE_CSS', format.SITE_CSS + '        .x { }\n'):
+            self.assertEqual(self.converted(self.build()), sorted(SOURCES))
+            self.assertIn('.x { }', self.read('index.html'))
+            self.assertEqual(self.converted(self.build()), [])
+
+    def test_removed_source(self):
+        self.build()
+        os.remove(self.path('b/index.md'))
+        self.build()
+        # the page stays until --prune
+        self.assertTrue(os.path.exists(self.path('b/index.html')))
+        manifest = self.manifest()
+        self.assertNotIn('b/index.md', manifest['files'])
+        self.assertEqual(list(manifest['orphans']), ['b/index.md'])
+        self.assertEqual(format.plan_build(self.root)['delete'], ['b/index.html'])
+
+        self.build(prune=True)
+        self.assertFalse(os.path.exists(self.path('b/index.html')))
+        self.assertEqual(self.manifest()['orphans'], {})
+        self.assertEqual(format.plan_build(self.root)['delete'], [])
+
+    def test_plan_matches_build(self):
+        self.build()
+        self.write('a/index.md', '# Page A\n\nEdited.\n')
+        self.write('c/index.md', '# Page C\n')
+        plan = format.plan_build(self.root)
+        self.assertEqual((plan['add'], plan['change'], plan['delete'], plan['unchanged']),
+                         (['c/index.html'], ['a/index.html'], [], 2))
+        self.assertFalse(plan['config_changed'])
+        self.assertFalse(os.path.exists(self.path('c/index.html')))
+        self.assertEqual(self.converted(self.build()), ['a/index.md', 'c/index.md'])
+        self.assertEqual(format.plan_build(self.root)['unchanged'], 4)
+
+
+class FilteredBuildTest(BuildTestCase):
+
+    def test_exclude_keeps_other_entries(self):
+        self.build()
+        files = self.manifest()['files']
+        self.write('a/index.md', '# Page A\n\nEdited.\n')
+        self.write('b/index.md', '# Page B\n\nEdited.\n')
+        self.assertEqual(self.converted(self.build(exclude=['b/'])), ['a/index.md'])
+        after = self.manifest()['files']
+        self.assertEqual(sorted(after), sorted(SOURCES))
+        self.assertEqual(after['b/index.md'], files['b/index.md'])
+        self.assertNotIn('Edited.', self.read('b/index.html'))
+        self.assertEqual(self.converted(self.build()), ['b/index.md'])
+
+    def test_removed_source_inside_filter(self):
+        self.build()
+        os.remove(self.path('b/index.md'))
+        self.build(include=['b/'])
+        self.assertNotIn('b/index.md', self.manifest()['files'])
+        self.assertIn('b/index.md', self.manifest()['orphans'])
+
+    def test_force_include_keeps_other_pages(self):
+        options = dict(search=True, sitemap=True, base_url='https://example.org')
+        self.build(**options)
+        self.assertEqual(len(json.loads(self.read('search/docs.json'))), 3)
+        self.assertEqual(self.read('sitemap.xml').count('<loc>'), 3)
+
+        output = self.build(force=True, include=['a/'], **options)
+        self.assertEqual(self.converted(output), ['a/index.md'])
+        files = self.manifest()['files']
+        self.assertEqual(sorted(files), sorted(SOURCES))
+        self.assertIsNotNone(files['a/index.md']['source'])
+        # not rebuilt by the filtered run, so the next full build must
+        self.assertIsNone(files['b/index.md']['source'])
+        self.assertEqual(len(json.loads(self.read('search/docs.json'))), 3)
+        self.assertEqual(self.read('sitemap.xml').count('<loc>'), 3)
+
+        output = self.build(**options)
+        self.assertEqual(self.converted(output), ['b/index.md', 'index.md'])
+        self.assertEqual(self.converted(self.build(**options)), [])
+
+
+class SearchIndexTest(BuildTestCase):
+
+    def docs(self):
+        return {doc[0]: doc[1] for doc in json.loads(self.read('search/docs.json')) if doc}
+
+    def shard(self, term):
+        path = self.path(f'search/{format.search_shard(term)}.json')
+        if not os.path.exists(path):
+            return {}
+        return json.loads(self.read(os.path.relpath(path, self.root)))
+
+    def test_index_follows_edits(self):
+        self.build(search=True)
+        self.assertEqual(self.docs(), {'/': 'Home', '/a/': 'Page A', '/b/': 'Page B'})
+        self.assertNotIn('zebra', self.shard('zebra'))
+
+        self.write('a/index.md', '# Zebra crossing\n\nA zebra page.\n')
+        self.assertEqual(self.converted(self.build(search=True)), ['a/index.md'])
+        self.assertEqual(self.docs()['/a/'], 'Zebra crossing')
+        self.assertIn('zebra', self.shard('zebra'))
+
+        self.write('a/index.md', SOURCES['a/index.md'])
+        self.build(search=True)
+        self.assertNotIn('zebra', self.shard('zebra'))
+
+    def test_removed_source_leaves_index(self):
+        self.build(search=True)
+        os.remove(self.path('b/index.md'))
+        self.build(search=True)
+        self.assertEqual(self.docs(), {'/': 'Home', '/a/': 'Page A'})
+        self.assertNotIn('second', self.shard('second'))
+
+    def test_lost_index_is_rebuilt(self):
+        self.build(search=True)
+        shutil.rmtree(self.path('search'))
+        self.assertEqual(self.converted(self.build(search=True)), [])
+        self.assertEqual(len(self.docs()), 3)
+        self.assertIn('first', self.shard('first'))
+
+    def test_lost_cache_renders_again(self):
+        self.build(search=True)
+        os.remove(format.search_cache_path(self.root))
+        self.assertEqual(self.converted(self.build(search=True)), sorted(SOURCES))
+        self.assertEqual(len(self.docs()), 3)
+
+
+class CompressionTest(BuildTestCase):
+
+    def test_siblings_match_their_file(self):
+        self.build(compress=('gzip',), sitemap=True, base_url='https://example.org')
+        for rel in ('index.html', 'a/index.html', 'sitemap.xml'):
+            with gzip.open(self.path(rel + '.gz'), 'rb') as f:
+                self.assertEqual(f.read().decode('utf-8'), self.read(rel))
+        for entry in self.manifest()['files'].values():
+            self.assertEqual(entry['compressed'], entry['output'])
+
+    def test_switched_on_for_an_unchanged_tree(self):
+        self.build()
+        self.assertFalse(os.path.exists(self.path('a/index.html.gz')))
+        self.assertIn('a/index.html.gz', format.plan_build(
+            self.root, format.BuildOptions(compress=('gzip',)))['add'])
+        # compress only changes the files next to the pages
+        self.assertEqual(self.converted(self.build(compress=('gzip',))), [])
+        self.assertTrue(os.path.exists(self.path('a/index.html.gz')))
+
+    def test_rewrite_without_compression_drops_siblings(self):
+        self.build(compress=('gzip',))
+        self.assertTrue(os.path.exists(self.path('a/index.html.gz')))
+        self.assertTrue(os.path.exists(self.path('b/index.html.gz')))
+
+        self.write('a/index.md', '# Page A\n\nEdited.\n')
+        plan = format.plan_build(self.root)
+        self.assertIn('a/index.html.gz', plan['delete'])
+        self.assertNotIn('b/index.html.gz', plan['delete'])
+
+        self.build()
+        # the edited page's sibling would serve the old bytes
+        self.assertFalse(os.path.exists(self.path('a/index.html.gz')))
+        self.assertTrue(os.path.exists(self.path('b/index.html.gz')))
+        self.assertIsNone(self.manifest()['files']['a/index.md'].get('compressed'))
+
+
+class PruneTest(BuildTestCase):
+
+    def test_superseded_assets(self):
+        self.build(external_assets=True)
+        first = sorted(os.listdir(self.path('assets')))
+        self.assertEqual(len(first), 2)
+
+        # the search box changes both files, so both get a new name
+        self.build(external_assets=True, search=True)
+        self.assertEqual(len(os.listdir(self.path('assets'))), 4)
+        plan = format.plan_build(self.root, format.BuildOptions(external_assets=True, search=True))
+        self.assertEqual(sorted(plan['delete']), ['assets/' + name for name in first])
+        self.assertEqual(plan['orphans'], 2)
+
+        self.build(external_assets=True, search=True, prune=True)
+        current = sorted(os.listdir(self.path('assets')))
+        self.assertEqual(len(current), 2)
+        self.assertFalse(set(first) & set(current))
+        self.assertEqual(sorted(rel for rel in self.manifest()['outputs'] if rel.startswith('assets/')),
+                         ['assets/' + name for name in current])
+
+    def test_outputs_of_options_switched_off(self):
+        self.build(search=True, sitemap=True, base_url='https://example.org')
+        shards = ['search/' + name for name in os.listdir(self.path('search'))]
+        self.assertIn('search/docs.json', shards)
+        self.assertEqual(sorted(self.manifest()['outputs']), sorted(shards + ['sitemap.xml']))
+
+        self.build()
+        # kept until asked for, like the pages of removed sources
+        self.assertTrue(os.path.exists(self.path('sitemap.xml')))
+        self.assertEqual(sorted(format.plan_build(self.root)['delete']),
+                         sorted(shards + ['sitemap.xml']))
+
+        self.build(prune=True)
+        self.assertFalse(os.path.exists(self.path('sitemap.xml')))
+        self.assertFalse(os.path.exists(self.path('search')))
+        self.assertEqual(self.manifest()['outputs'], {})
+        self.assertEqual(format.plan_build(self.root)['delete'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
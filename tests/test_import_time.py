@@ -0,0 +1,61 @@
+"""Start-up budget of tool/format.py: importing it must stay cheap and must
+not pull in the Markdown stack or any optional dependency."""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TOOL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tool')
+
+# Self time of the format module in milliseconds (its own top level, not
+# the stdlib modules it imports), best of RUNS. Around 4 ms today; compiling
+# every regex up front used to cost about 10 to 12.
+IMPORT_BUDGET_MS = 8
+RUNS = 5
+
+# Must only be imported once a build actually needs them
+LAZY_MODULES = ('markdown', 'bs4', 'pygments', 'yaml', 'tomllib', 'PIL', 'brotli',
+                'http.server', 'concurrent.futures', 'multiprocessing', 'argparse',
+                'urllib.parse', 'datetime', 'tempfile')
+
+
+def run_python(code, pycache):
+    # A private pycache so the timing does not include compiling format.py
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=TOOL_DIR, env=env, capture_output=True, text=True, check=True)
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pycache = tempfile.mkdtemp(prefix='pycache-')
+        run_python('import format', self.pycache)  # warm the pycache
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.pycache, ignore_errors=True)
+
+    def test_self_time_within_budget(self):
+        best = None
+        for _ in range(RUNS):
+            stderr = run_python('import format', self.pycache).stderr
+            m = re.search(r'^import time:\s+(\d+) \|\s+\d+ \| format$', stderr, re.MULTILINE)
+            self.assertIsNotNone(m, stderr)
+            micros = int(m.group(1))
+            best = micros if best is None else min(best, micros)
+        self.assertLess(best / 1000, IMPORT_BUDGET_MS)
+
+    def test_no_heavy_imports(self):
+        code = ('import sys, format; '
+                f'print(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))')
+        loaded = run_python(code, self.pycache).stdout.strip()
+        self.assertEqual(loaded, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
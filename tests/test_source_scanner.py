@@ -0,0 +1,83 @@
+"""--include / --exclude matching of tool/format.py's SourceScanner."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tool'))
+
+import format  # noqa: E402
+
+SOURCES = ('index.md', 'section-01.md', 'section-01/index.md', 'section-01/page-00001/index.md',
+           'section-02/index.md', 'notes/section-01/a.md')
+
+
+class SourceScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='scanner-')
+        for key in SOURCES:
+            path = os.path.join(self.root, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('# x\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def scan(self, include=(), exclude=()):
+        scanner = format.SourceScanner(self.root, include, exclude)
+        found = sorted(os.path.relpath(path, self.root).replace(os.sep, '/') for path in scanner)
+        # is_ignored must agree with the walk
+        self.assertEqual(found, sorted(key for key in SOURCES
+                                       if not scanner.is_ignored(os.path.join(self.root, key))))
+        return found
+
+    def test_no_filters(self):
+        self.assertEqual(self.scan(), sorted(SOURCES))
+
+    def test_include_directory(self):
+        below = ['notes/section-01/a.md', 'section-01/index.md', 'section-01/page-00001/index.md']
+        # the file section-01.md is not the directory section-01
+        self.assertEqual(self.scan(['section-01']), below)
+        self.assertEqual(self.scan(['section-01/']), below)
+
+    def test_include_anchored_directory(self):
+        self.assertEqual(self.scan(['/section-01']),
+                         ['section-01/index.md', 'section-01/page-00001/index.md'])
+
+    def test_include_file(self):
+        self.assertEqual(self.scan(['section-01/page-00001/index.md']),
+                         ['section-01/page-00001/index.md'])
+        self.assertEqual(self.scan(['section-01.md']), ['section-01.md'])
+
+    def test_include_glob(self):
+        self.assertEqual(self.scan(['section-*/index.md']),
+                         ['section-01/index.md', 'section-02/index.md'])
+        self.assertEqual(self.scan(['section-0[2-9]']), ['section-02/index.md'])
+
+    def test_exclude_wins(self):
+        self.assertEqual(self.scan(['section-01/'], ['page-*/']),
+                         ['notes/section-01/a.md', 'section-01/index.md'])
+
+    def test_is_pruned(self):
+        os.makedirs(os.path.join(self.root, '.git'))
+        with open(os.path.join(self.root, '.gitignore'), 'w', encoding='utf-8') as f:
+            f.write('drafts/\n*.log\n')
+        scanner = format.SourceScanner(self.root, exclude=['notes/'])
+        pruned = lambda rel, is_dir=False: scanner.is_pruned(os.path.join(self.root, rel), is_dir)
+        self.assertFalse(pruned('', True))
+        self.assertFalse(pruned('section-01/style.css'))
+        self.assertTrue(pruned('.git', True))
+        self.assertTrue(pruned('.git/config'))
+        self.assertTrue(pruned('.mdui-cache/manifest.json'))
+        self.assertTrue(pruned('drafts/a.png'))
+        self.assertTrue(pruned('build.log'))
+        self.assertTrue(pruned('notes/section-01/a.html'))
+        self.assertTrue(pruned('../outside.html'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark for format.py
+===========================================================================
+
+Generates a reproducible synthetic Markdown corpus and times a full
+`process_all_markdown_files` run, a no-op (everything up to date) run and
+each stage of `convert_markdown_file` (as reported by its stats). Results
+are printed as JSON so runs on different commits can be compared.
+
+Usage
+================
+```
+python tool/benchmark.py --files 500 --blocks 40 --code 0.2 --cjk 0.7 -o before.json
+python tool/benchmark.py --keep /tmp/corpus      # keep the corpus for inspection
+```
+---------------------------------------------------------------------------
+'''
+
+
+import os
+import io
+import sys
+import glob
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import format as mdformat
+
+
+CJK_CHARS = ('的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动'
+             '同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自'
+             '二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日')
+LATIN_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+               'incididunt ut labore et dolore magna aliqua build render page markdown table '
+               'network kernel driver python template cache index search').split()
+CODE_LANGS = ['python', 'bash', 'javascript', 'c', '']
+ADMONITIONS = ['note', 'warning', 'tip', 'danger']
+
+
+def _words(rng, count, cjk):
+    out = []
+    for _ in range(count):
+        if rng.random() < cjk:
+            out.append(''.join(rng.choice(CJK_CHARS) for _ in range(rng.randint(2, 6))))
+        else:
+            out.append(rng.choice(LATIN_WORDS))
+    return out
+
+def _sentence(rng, cjk):
+    words = _words(rng, rng.randint(6, 18), cjk)
+    if rng.random() < 0.2:
+        i = rng.randrange(len(words))
+        words[i] = rng.choice(['**' + words[i] + '**', '`' + words[i] + '`',
+                               '[' + words[i] + '](https://example.com/' + str(i) + ')'])
+    return ' '.join(words) + ('。' if cjk > 0.5 else '.')
+
+def _paragraph(rng, cjk):
+    return ' '.join(_sentence(rng, cjk) for _ in range(rng.randint(2, 5)))
+
+def _code_block(rng):
+    lang = rng.choice(CODE_LANGS)
+    lines = []
+    for i in range(rng.randint(3, 25)):
+        indent = '    ' * rng.randint(0, 2)
+        lines.append(f'{indent}value_{i} = compute("{rng.choice(LATIN_WORDS)}", {rng.randint(0, 999)}) < 10')
+    return '```' + lang + '\n' + '\n'.join(lines) + '\n```'
+
+def _table(rng, cjk):
+    cols = rng.randint(2, 6)
+    header = '| ' + ' | '.join(_words(rng, cols, cjk)) + ' |'
+    sep = '| ' + ' | '.join('---' for _ in range(cols)) + ' |'
+    rows = ['| ' + ' | '.join(_words(rng, cols, cjk)) + ' |' for _ in range(rng.randint(2, 12))]
+    return '\n'.join([header, sep] + rows)
+
+def _admonition(rng, cjk):
+    kind = rng.choice(ADMONITIONS)
+    return f'!!! {kind} "{" ".join(_words(rng, 3, cjk))}"\n    {_paragraph(rng, cjk)}'
+
+def generate_document(rng, blocks, code, tables, admonitions, cjk):
+    parts = ['# ' + ' '.join(_words(rng, 4, cjk))]
+    for _ in range(blocks):
+        r = rng.random()
+        if r < code:
+            parts.append(_code_block(rng))
+        elif r < code + tables:
+            parts.append(_table(rng, cjk))
+        elif r < code + tables + admonitions:
+            parts.append(_admonition(rng, cjk))
+        elif rng.random() < 0.15:
+            parts.append('#' * rng.randint(2, 4) + ' ' + ' '.join(_words(rng, 3, cjk)))
+        else:
+            parts.append(_paragraph(rng, cjk))
+    return '\n\n'.join(parts) + '\n'
+
+def generate_corpus(root, files, blocks, code, tables, admonitions, cjk, seed):
+    # The layout mirrors this repository: pages live next to a tool/
+    # directory, because process_all_markdown_files scans its parent.
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, 'tool'), exist_ok=True)
+    total = 0
+    for i in range(files):
+        directory = os.path.join(root, f'section-{i % 20:02d}', f'page-{i:05d}')
+        os.makedirs(directory, exist_ok=True)
+        text = generate_document(rng, blocks, code, tables, admonitions, cjk)
+        data = text.encode('utf-8')
+        with open(os.path.join(directory, 'index.md'), 'wb') as f:
+            f.write(data)
+        total += len(data)
+    return total
+
+def _quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+def _summary(samples):
+    return {'runs': samples, 'min': min(samples), 'median': statistics.median(samples)}
+
+def time_full_build(root, repeat, jobs, options):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with _quiet():
+            mdformat.process_all_markdown_files(os.path.join(root, 'tool'), force=True,
+                                                jobs=jobs, options=options())
+        samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+def time_noop_build(root, repeat, jobs, options):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with _quiet():
+            mdformat.process_all_markdown_files(os.path.join(root, 'tool'),
+                                                jobs=jobs, options=options())
+        samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+def time_stages(root, options):
+    # Per-stage clocks come from convert_markdown_file's own stats
+    stages = {}
+    opts = options()
+    renderer = mdformat.Renderer()
+    md_files = sorted(glob.glob(os.path.join(root, '**/*.md'), recursive=True))
+    for md_file in md_files:
+        stats = {}
+        mdformat.convert_markdown_file(md_file, renderer=renderer, options=opts, stats=stats)
+        for name, seconds in stats['time'].items():
+            stages[name] = stages.get(name, 0.0) + seconds
+    return {'files': len(md_files), 'seconds': stages,
+            'per_file_ms': {name: seconds * 1000 / max(1, len(md_files))
+                            for name, seconds in stages.items()}}
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark format.py on a synthetic corpus.')
+    parser.add_argument('--files', type=int, default=200, help='number of documents')
+    parser.add_argument('--blocks', type=int, default=40, help='top-level blocks per document')
+    parser.add_argument('--code', type=float, default=0.15, help='fraction of blocks that are code')
+    parser.add_argument('--tables', type=float, default=0.05, help='fraction of blocks that are tables')
+    parser.add_argument('--admonitions', type=float, default=0.05,
+                        help='fraction of blocks that are admonitions')
+    parser.add_argument('--cjk', type=float, default=0.5, help='fraction of words in CJK text')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('--minify', action='store_true')
+    parser.add_argument('--keep', metavar='DIR', help='generate the corpus here and keep it')
+    parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    root = args.keep or tempfile.mkdtemp(prefix='mdui-bench-')
+    try:
+        corpus_bytes = generate_corpus(root, args.files, args.blocks, args.code, args.tables,
+                                       args.admonitions, args.cjk, args.seed)
+
+        def options():
+            return mdformat.BuildOptions(minify=args.minify)
+
+        report = {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'markdown': mdformat.import_markdown().__version__,
+            'corpus': {'files': args.files, 'blocks': args.blocks, 'code': args.code,
+                       'tables': args.tables, 'admonitions': args.admonitions, 'cjk': args.cjk,
+                       'seed': args.seed, 'bytes': corpus_bytes},
+            'jobs': args.jobs,
+            'minify': args.minify,
+            'full_build': time_full_build(root, args.repeat, args.jobs, options),
+            'noop_build': time_noop_build(root, args.repeat, args.jobs, options),
+            'stages': time_stages(root, options),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -19,8 +19,10 @@ Usage
 ================
 ```
 $> git submodule add https://gist.github.com/11c348d4db33716cc78cf74329271b33.git
+pip install markdown
 python 11c348d4db33716cc78cf74329271b33/format.py
 ```
+Run it with `--help` for the build options.
 If you want to use this script in your project please keep this header.
 
 
@@ -66,42 +68,106 @@ License
 
 
 import os
-try:
-    import markdown
-    from bs4 import BeautifulSoup
-    import glob
-except ModuleNotFoundError:
-    if os.name == 'posix':
-        os.system('sudo apt install python3-full python3-markdown')
-    os.system('pip install markdown beautifulsoup4')
-    import markdown
-    from bs4 import BeautifulSoup
-    import glob
+import re
+import sys
+import html
+import json
+import time
+import struct
+import select
+import hashlib
+import functools
+# markdown (and other heavy modules) are imported on first use so that
+# --help, no-op incremental runs and pre-commit hooks start instantly.
 
 
-HTML_TEMPLATE = """<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <meta http-equiv="X-UA-Compatible" content="IE=edge">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <meta name="google" content="notranslate" />
-    <title>{title}</title>
-    <link rel="icon" href="/favicon.png" type="image/png">
-    <link rel="shortcut icon" href="/favicon.png" type="image/png">
-    <!-- MDUI CSS -->
-    <link rel="stylesheet" href="https://unpkg.com/mdui@1.0.2/dist/css/mdui.min.css" onerror="this.onerror=null;this.href='https://cdnjs.cloudflare.com/ajax/libs/mdui/1.0.2/css/mdui.min.css';">
-    <style>
-        body {{ font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Helvetica, Arial, sans-serif; line-height: 1.6; margin: 0; padding: 0; }}
+MARKDOWN_EXTENSIONS = ['fenced_code', 
+                       'tables', 
+                       'nl2br',
+                       'sane_lists',
+                       'attr_list',
+                       'def_list',
+                       'admonition']
+
+# Build state lives next to the generated site, e.g. <root>/.mdui-cache/manifest.json
+CACHE_DIR_NAME = '.mdui-cache'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 2
+# Link check results of the last --check-links run, reused while neither the
+# page nor its link targets change
+LINKS_CACHE_NAME = 'links.json'
+# Fingerprinted copies of SITE_CSS / SITE_JS, e.g. <root>/assets/site.<hash>.css
+ASSETS_DIR_NAME = 'assets'
+# Highlighted code blocks, <root>/.mdui-cache/highlight/<hh>/<sha256>.html
+HIGHLIGHT_DIR_NAME = 'highlight'
+HIGHLIGHT_MEMO_SIZE = 4096
+# Rendered sections of large documents by content hash,
+# <root>/.mdui-cache/sections/<hh>/<sha256>.json. Bump the version whenever
+# the tree processor changes what it emits.
+SECTIONS_DIR_NAME = 'sections'
+SECTION_CACHE_VERSION = 3
+SECTION_SPLIT_MIN_SIZE = 32 * 1024
+SECTION_MEMO_SIZE = 1024
+# Image info by content hash, <root>/.mdui-cache/images/<hh>/<sha256>.json;
+# downscaled variants go to <root>/assets/img/<sha256[:16]>-<width>.<ext>
+IMAGES_DIR_NAME = 'img'
+IMAGE_CACHE_DIR_NAME = 'images'
+IMAGE_VARIANT_TYPES = ('.png', '.jpg', '.jpeg', '.webp')
+# Matches the 900px content column of SITE_CSS
+IMAGE_SIZES = '(max-width: 900px) 100vw, 900px'
+# Search index: <root>/search/docs.json plus one shard per term prefix,
+# e.g. search/61.json ('a...') or search/u4e2.json (U+4E20..U+4E2F)
+SEARCH_DIR_NAME = 'search'
+SEARCH_CACHE_NAME = 'search.json'
+SEARCH_INDEX_VERSION = 1
+SEARCH_TITLE_WEIGHT = 5
+# Tokenizer character classes, shared with SEARCH_JS. Separator runs split
+# terms; CJK runs are indexed as overlapping bigrams, other runs as words.
+# Astral characters count as separators because JS sees them as surrogates.
+SEARCH_SEPARATOR_RANGES = [(0x00, 0x2f), (0x3a, 0x40), (0x5b, 0x5e), (0x60, 0x60),
+                           (0x7b, 0xbf), (0x2000, 0x206f), (0x3000, 0x303f),
+                           (0xd800, 0xf8ff), (0xfe30, 0xfe4f), (0xff00, 0xff0f),
+                           (0xff1a, 0xff20), (0xff3b, 0xff40), (0xff5b, 0xff65),
+                           (0xfff0, 0x10ffff)]
+SEARCH_CJK_RANGES = [(0x3040, 0x30ff), (0x3400, 0x9fff), (0xac00, 0xd7af), (0xf900, 0xfaff)]
+# Service worker, <root>/sw.js. Its manifest maps every URL to a content
+# hash; an update only refetches the entries whose hash changed. Only the
+# shared assets are precached, pages are cached as they are visited.
+# A sw.js without the marker line was not written by us and is left alone.
+SERVICE_WORKER_NAME = 'sw.js'
+SERVICE_WORKER_MARKER = '// Generated by format.py --service-worker'
+# Pinned CDN files of the templates: the versioned URL stands in for a hash
+PRECACHE_CDN_URLS = ('https://unpkg.com/mdui@1.0.2/dist/css/mdui.min.css',
+                     'https://unpkg.com/mdui@1.0.2/dist/js/mdui.min.js',
+                     'https://cdn.staticfile.net/translate.js/3.12.0/translate.js')
+# Characters the browser leaves alone in URL paths (everything else is
+# percent-encoded), so manifest keys match what the worker sees
+_URL_PATH_SAFE = "/!$&'()*+,-.:;=@[]^_|~"
+# Page metadata (title, summary, front matter, mtime) read straight from the
+# sources without rendering, <root>/.mdui-cache/pages.json, and what is
+# built from it: sitemap.xml, an Atom feed and per-directory listing pages
+PAGES_CACHE_NAME = 'pages.json'
+PAGES_INDEX_VERSION = 1
+SITEMAP_NAME = 'sitemap.xml'
+FEED_NAME = 'feed.xml'
+FEED_SIZE = 20
+SUMMARY_LENGTH = 200
+# Listing pages are only ever written over files carrying this tag, so a
+# hand-written index.html (or 404.html) is never replaced
+LISTING_MARKER = '<meta name="generator" content="format.py --listings">'
+
+
+SITE_CSS = """
+        body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Helvetica, Arial, sans-serif; line-height: 1.6; margin: 0; padding: 0; }
         
-        .mdui-container {{ max-width: 900px; padding: 2rem; }}
-        .mdui-container-with-appbar {{ padding-top: 4rem; }}
-        pre {{ background: #f6f8fa; padding: 16px; border-radius: 6px; position: relative; overflow-x: auto; white-space: pre-wrap; word-wrap: break-word; transition: all 0.3s; }}
+        .mdui-container { max-width: 900px; padding: 2rem; }
+        .mdui-container-with-appbar { padding-top: 4rem; }
+        pre { background: #f6f8fa; padding: 16px; border-radius: 6px; position: relative; overflow-x: auto; white-space: pre-wrap; word-wrap: break-word; transition: all 0.3s; }
         
-        .mdui-theme-layout-dark pre {{ background: #1e1e1e; color: #f0f0f0; }}
+        .mdui-theme-layout-dark pre { background: #1e1e1e; color: #f0f0f0; }
         
-        code {{ word-wrap: break-word; }}
-        .copy-btn {{ 
+        code { word-wrap: break-word; }
+        .copy-btn { 
             position: absolute; 
             right: 4px; 
             top: 4px; 
@@ -117,120 +183,120 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             min-width: 32px;
             min-height: 32px;
             box-shadow: none;
-        }}
+        }
         
-        .copy-btn.copy-success {{
+        .copy-btn.copy-success {
             color: #4CAF50 !important;
-        }}
+        }
         
-        .mdui-theme-layout-dark .copy-btn {{ 
+        .mdui-theme-layout-dark .copy-btn { 
             background-color: rgba(30, 30, 30, 0.7);
             color: #9e9e9e;
             border: none;
-        }}
+        }
         
-        @media (hover: hover) and (pointer: fine) {{
-            pre:hover .copy-btn {{ 
+        @media (hover: hover) and (pointer: fine) {
+            pre:hover .copy-btn { 
                 display: block; 
                 animation: fadeIn 0.3s; 
-            }}
-        }}
+            }
+        }
         
-        .touch-device .copy-btn {{ 
+        .touch-device .copy-btn { 
             display: block; 
             opacity: 0.9; 
-        }}
+        }
         
-        .mdui-table {{ 
+        .mdui-table { 
             width: 100%; 
             margin: 1em 0; 
             border-collapse: collapse; 
             transition: all 0.3s; 
-        }}
+        }
         
-        .mdui-table-responsive {{ 
+        .mdui-table-responsive { 
             overflow-x: auto; 
             margin-bottom: 1em; 
-        }}
+        }
         
-        img {{ max-width: 100%; height: auto; transition: all 0.3s; }}
+        img { max-width: 100%; height: auto; transition: all 0.3s; }
         
-        blockquote {{ 
+        blockquote { 
             margin: 1em 0; 
             padding: 0 1em; 
             border-left: 0.25em solid; 
             transition: all 0.3s; 
-        }}
+        }
         
-        .mdui-theme-layout-dark blockquote {{ 
+        .mdui-theme-layout-dark blockquote { 
             color: #9e9e9e; 
             border-left-color: #555; 
-        }}
+        }
         
-        .theme-switch {{ 
+        .theme-switch { 
             position: fixed; 
             bottom: 20px; 
             right: 20px; 
             z-index: 9999; 
-        }}
+        }
         
-        * html .copy-btn {{ 
+        * html .copy-btn { 
             position: static; 
             margin-top: -30px; 
             margin-right: 5px; 
             float: right; 
-        }}
+        }
         
-        * html .theme-switch {{ 
+        * html .theme-switch { 
             position: absolute; 
             bottom: auto; 
             top: expression(eval(document.documentElement.scrollTop+document.documentElement.clientHeight-60)); 
-        }}
+        }
         
-        .mdui-container {{ 
+        .mdui-container { 
             animation: slideIn 0.5s ease; 
-        }}
+        }
         
-        @keyframes slideIn {{
-            from {{ opacity: 0; transform: translateY(15px); }}
-            to {{ opacity: 1; transform: translateY(0); }}
-        }}
+        @keyframes slideIn {
+            from { opacity: 0; transform: translateY(15px); }
+            to { opacity: 1; transform: translateY(0); }
+        }
         
-        h1, h2, h3, h4, h5, h6 {{ 
+        h1, h2, h3, h4, h5, h6 { 
             animation: slideInFromLeft 0.5s ease; 
             transition: all 0.3s; 
-        }}
+        }
         
-        @keyframes slideInFromLeft {{
-            from {{ opacity: 0; transform: translateX(-15px); }}
-            to {{ opacity: 1; transform: translateX(0); }}
-        }}
+        @keyframes slideInFromLeft {
+            from { opacity: 0; transform: translateX(-15px); }
+            to { opacity: 1; transform: translateX(0); }
+        }
         
-        @media (max-width: 320px) {{
-            .mdui-container {{ padding: 0.8rem; }}
-            h1, h2 {{ font-size: 1.2rem; }}
-            pre {{ padding: 8px; font-size: 0.8rem; }}
-        }}
+        @media (max-width: 320px) {
+            .mdui-container { padding: 0.8rem; }
+            h1, h2 { font-size: 1.2rem; }
+            pre { padding: 8px; font-size: 0.8rem; }
+        }
         
-        .mdui-drawer .mdui-card {{
+        .mdui-drawer .mdui-card {
             margin: 16px;
             overflow: hidden; 
-        }}
+        }
         
-        .mdui-drawer .mdui-card-primary {{
+        .mdui-drawer .mdui-card-primary {
             padding: 16px;
-        }}
+        }
         
-        .mdui-drawer .mdui-card-primary-title {{
+        .mdui-drawer .mdui-card-primary-title {
             font-size: 20px;
             line-height: 1.4;
             word-break: break-word;
             white-space: normal;
             overflow-wrap: break-word;
             max-width: 100%;
-        }}
+        }
         
-        .mdui-drawer .mdui-card-primary-subtitle {{
+        .mdui-drawer .mdui-card-primary-subtitle {
             font-size: 14px;
             line-height: 1.4;
             word-break: break-word;
@@ -238,62 +304,56 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             overflow-wrap: break-word;
             cursor: pointer;
             max-width: 100%;
-        }}
+        }
         
-        .mdui-drawer {{
+        .mdui-drawer {
             background-color: #fff;
             transition: top 0.3s, height 0.3s;
-        }}
+        }
         
-        .mdui-theme-layout-dark .mdui-drawer {{
+        .mdui-theme-layout-dark .mdui-drawer {
             background-color: #303030;
-        }}
+        }
         
-        @media (min-width: 1024px) {{
-            .mdui-drawer-open {{
+        @media (min-width: 1024px) {
+            .mdui-drawer-open {
                 padding-top: 12px;
-            }}
+            }
             
-            body.has-appbar .mdui-drawer {{
+            body.has-appbar .mdui-drawer {
                 height: calc(100% - var(--appbar-height, 64px));
                 top: var(--appbar-height, 64px);
-            }}
+            }
             
-            body.appbar-hidden .mdui-drawer {{
+            body.appbar-hidden .mdui-drawer {
                 height: 100%;
                 top: 0;
-            }}
-        }}
+            }
+        }
         
-        .mdui-drawer .mdui-list-item {{
+        .mdui-drawer .mdui-list-item {
             min-height: 36px;
             padding-top: 4px;
             padding-bottom: 4px;
-        }}
+        }
         
-        .mdui-drawer .mdui-list-item-content {{
+        .mdui-drawer .mdui-list-item-content {
             line-height: 20px;
-        }}
+        }
         
-        .mdui-toolbar .toc-btn {{
+        .mdui-toolbar .toc-btn {
             height: 48px;
             width: 48px;
-        }}
-    </style>
-    <!--[if IE]>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/es6-promise/4.2.8/es6-promise.auto.min.js"></script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/html5shiv/3.7.3/html5shiv.min.js"></script>
-    <script src="https://gcore.jsdelivr.net/npm/classlist-polyfill@1.2.0/src/index.min.js"></script>
-    <script src="https://gcore.jsdelivr.net/npm/eligrey-classlist-js-polyfill@1.2.20171210/classList.min.js"></script>
-    <![endif]-->
-    <script src="https://unpkg.com/mdui@1.0.2/dist/js/mdui.min.js" onerror="this.onerror=null;this.src='https://cdnjs.cloudflare.com/ajax/libs/mdui/1.0.2/js/mdui.min.js';"></script>
-    <script>
+        }
+"""
+
+SITE_JS = """
     // fxxk ie
-    function isIE() {{
+    function isIE() {
         return window.navigator.userAgent.indexOf('MSIE ') > -1 || window.navigator.userAgent.indexOf('Trident/') > -1;
-    }}
+    }
     
-    function detectBrowser() {{
+    function detectBrowser() {
         var ua = window.navigator.userAgent;
         var isIE = ua.indexOf('MSIE ') > -1 || ua.indexOf('Trident/') > -1;
         var isOldEdge = ua.indexOf('Edge/') > -1;
@@ -302,7 +362,7 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         
         var isOldBrowser = isIE || (isOldEdge && ua.indexOf('Edge/') > 0 && parseInt(ua.split('Edge/')[1]) < 18);
         
-        return {{
+        return {
             isOldBrowser: isOldBrowser,
             isIE: isIE,
             browserName: isIE ? 'Internet Explorer' : 
@@ -310,47 +370,47 @@ HTML_TEMPLATE = """<!DOCTYPE html>
                        isChrome ? 'Chrome' : 
                        isFirefox ? 'Firefox' : 
                        'Unknown Browser'
-        }};
-    }}
+        };
+    }
     
-    function isTouchDevice() {{
+    function isTouchDevice() {
         return ('ontouchstart' in window) || 
                (navigator.maxTouchPoints > 0) || 
                (navigator.msMaxTouchPoints > 0);
-    }}
+    }
     
-    function showBrowserNotice() {{
+    function showBrowserNotice() {
         var browserInfo = detectBrowser();
-        if (browserInfo.isOldBrowser) {{
-            try {{
-                if (typeof mdui !== 'undefined' && mdui.snackbar) {{
-                    mdui.snackbar({{
+        if (browserInfo.isOldBrowser) {
+            try {
+                if (typeof mdui !== 'undefined' && mdui.snackbar) {
+                    mdui.snackbar({
                         message: 'Seems you are using unsupported ' + browserInfo.browserName + ', some features may not work properly.',
                         buttonText: 'OK',
                         position: 'bottom',
                         timeout: 50000,
                         closeOnOutsideClick: true
-                    }});
-                }} else {{
+                    });
+                } else {
                     alert('You are using an unsupported ' + browserInfo.browserName + ', some features may not work properly.');
-                }}
-            }} catch (e) {{
+                }
+            } catch (e) {
                 console.error('show browser err :', e);
-            }}
-        }}
-    }}
+            }
+        }
+    }
     
-    function copyText(btn) {{
+    function copyText(btn) {
         var pre = btn.parentNode;
         var code = pre.querySelector('code');
         var text = code ? (code.innerText || code.textContent) : '';
         
-        if (window.clipboardData && window.clipboardData.setData) {{
+        if (window.clipboardData && window.clipboardData.setData) {
             window.clipboardData.setData("Text", text);
             showSnackbar('Copied to clipboard!');
             showCopySuccess(btn);
             return;
-        }}
+        }
         
         var textArea = document.createElement("textarea");
         textArea.value = text;
@@ -359,49 +419,49 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         document.body.appendChild(textArea);
         textArea.select();
         
-        try {{
+        try {
             var successful = document.execCommand('copy');
-            if (successful) {{
+            if (successful) {
                 showSnackbar('Copied to clipboard!');
                 showCopySuccess(btn);
-            }} else {{
+            } else {
                 showSnackbar('Failed to copy, please copy manually');
-            }}
-        }} catch (err) {{
+            }
+        } catch (err) {
             console.error('Failed copy:', err);
             showSnackbar('Failed to copy, please copy manually');
-        }}
+        }
         
         document.body.removeChild(textArea);
-    }}
+    }
     
-    function showCopySuccess(btn) {{
+    function showCopySuccess(btn) {
         var icon = btn.querySelector('i');
         var oldHtml = icon.innerHTML;
         icon.innerHTML = '&#xe86c;';
         btn.classList.add('copy-success');
         
-        setTimeout(function() {{
+        setTimeout(function() {
             icon.innerHTML = oldHtml;
             btn.classList.remove('copy-success');
-        }}, 2000);
-    }}
+        }, 2000);
+    }
     
-    function showSnackbar(message) {{
-        if (typeof mdui !== 'undefined' && mdui.snackbar) {{
-            mdui.snackbar({{
+    function showSnackbar(message) {
+        if (typeof mdui !== 'undefined' && mdui.snackbar) {
+            mdui.snackbar({
                 message: message,
                 position: 'bottom',
                 timeout: 2000,
                 closeOnOutsideClick: true
-            }});
-        }} else {{
+            });
+        } else {
             alert(message);
-        }}
-    }}
+        }
+    }
     
-    function showTranslateComplete(targetlangttl) {{
-        var languageMap = {{
+    function showTranslateComplete(targetlangttl) {
+        var languageMap = {
             'chinese_simplified': '<i class="mdui-icon material-icons">&#xe8e2;</i> 已翻译为简体中文',
             'chinese_traditional': '<i class="mdui-icon material-icons">&#xe8e2;</i> 已翻譯為繁體中文',
             'english': '<i class="mdui-icon material-icons">&#xe8e2;</i> Translated to English',
@@ -414,126 +474,126 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             'korean': '<i class="mdui-icon material-icons">&#xe8e2;</i> 한국어로 번역됨',
             'vietnamese': '<i class="mdui-icon material-icons">&#xe8e2;</i> Đã dịch sang tiếng Việt',
             'arabic': '<i class="mdui-icon material-icons">&#xe8e2;</i> ترجم إلى العربية'
-        }};
+        };
         var translatedMessage = languageMap[targetlangttl] || '<i class="mdui-icon material-icons">&#xe8e2;</i> Page translated.';
-                if (targetlangttl === 'arabic') {{
+                if (targetlangttl === 'arabic') {
             document.documentElement.setAttribute('dir', 'rtl');
             document.body.classList.add('mdui-rtl');
-        }} else {{
+        } else {
             document.documentElement.setAttribute('dir', 'ltr');
             document.body.classList.remove('mdui-rtl');
-        }}
+        }
         
-        if (typeof showTranslateComplete.lastMessage === 'undefined' || showTranslateComplete.lastMessage !== translatedMessage) {{
+        if (typeof showTranslateComplete.lastMessage === 'undefined' || showTranslateComplete.lastMessage !== translatedMessage) {
             showTranslateComplete.lastMessage = translatedMessage;
-            if (typeof mdui !== 'undefined' && mdui.snackbar) {{
-                mdui.snackbar({{
+            if (typeof mdui !== 'undefined' && mdui.snackbar) {
+                mdui.snackbar({
                     message: translatedMessage,
                     position: 'top',
                     buttonText: 'OK',
                     timeout: 5000,
                     closeOnOutsideClick: true
-                }});
-            }} else {{
+                });
+            } else {
                 console.log(translatedMessage);
-            }}
-        }}
-    }}
+            }
+        }
+    }
     
-    function toggleTheme() {{
+    function toggleTheme() {
         var body = document.body;
         var hasClass = body.className.indexOf('mdui-theme-layout-dark') > -1;
         
-        if (hasClass) {{
+        if (hasClass) {
             body.className = body.className.replace(/mdui-theme-layout-dark/g, '').trim();
-        }} else {{
+        } else {
             body.className = body.className + ' mdui-theme-layout-dark';
-        }}
-    }}
+        }
+    }
     
-    function ready(fn) {{
-        if (document.readyState !== 'loading') {{
+    function ready(fn) {
+        if (document.readyState !== 'loading') {
             fn();
-        }} else if (document.addEventListener) {{
+        } else if (document.addEventListener) {
             document.addEventListener('DOMContentLoaded', fn);
-        }} else {{
-            document.attachEvent('onreadystatechange', function() {{
+        } else {
+            document.attachEvent('onreadystatechange', function() {
                 if (document.readyState !== 'loading') fn();
-            }});
-        }}
-    }}
+            });
+        }
+    }
     
-    function updateAppbarHeight() {{
+    function updateAppbarHeight() {
         var appbar = document.querySelector('.mdui-appbar');
-        if (appbar) {{
+        if (appbar) {
             var height = appbar.offsetHeight;
             document.documentElement.style.setProperty('--appbar-height', height + 'px');
-        }}
-    }}
+        }
+    }
     
-    function setupAppbarObserver() {{
+    function setupAppbarObserver() {
         var appbar = document.querySelector('.mdui-appbar');
         if (!appbar) return;
         
         updateAppbarHeight();
         
-        if ('IntersectionObserver' in window) {{
-            var observer = new IntersectionObserver(function(entries) {{
-                if (entries[0].isIntersecting) {{
+        if ('IntersectionObserver' in window) {
+            var observer = new IntersectionObserver(function(entries) {
+                if (entries[0].isIntersecting) {
                     document.body.classList.remove('appbar-hidden');
                     document.body.classList.add('appbar-visible');
-                }} else {{
+                } else {
                     document.body.classList.remove('appbar-visible');
                     document.body.classList.add('appbar-hidden');
-                }}
-            }}, {{ threshold: 0.1 }});
+                }
+            }, { threshold: 0.1 });
             
             observer.observe(appbar);
-        }}
+        }
         
-        if ('ResizeObserver' in window) {{
-            var resizeObserver = new ResizeObserver(function() {{
+        if ('ResizeObserver' in window) {
+            var resizeObserver = new ResizeObserver(function() {
                 updateAppbarHeight();
-            }});
+            });
             
             resizeObserver.observe(appbar);
-        }}
-    }}
+        }
+    }
     
-    ready(function() {{
-        if (window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches) {{
+    ready(function() {
+        if (window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches) {
             document.body.className += ' mdui-theme-layout-dark';
-        }}
+        }
         
         document.body.className += ' has-appbar';
         
-        if (isTouchDevice()) {{
+        if (isTouchDevice()) {
             document.body.className += ' touch-device';
-        }}
+        }
         
         showBrowserNotice();
         
         var tables = document.querySelectorAll('table');
-        for (var i = 0; i < tables.length; i++) {{
+        for (var i = 0; i < tables.length; i++) {
             var table = tables[i];
-            if (table.className.indexOf('mdui-table') === -1) {{
+            if (table.className.indexOf('mdui-table') === -1) {
                 table.className += ' mdui-table';
                 var wrapper = document.createElement('div');
                 wrapper.className = 'mdui-table-responsive';
-                if (table.parentNode) {{
+                if (table.parentNode) {
                     table.parentNode.insertBefore(wrapper, table);
                     wrapper.appendChild(table);
-                }}
-            }}
-        }}
+                }
+            }
+        }
         
         var pres = document.querySelectorAll('pre');
-        for (var i = 0; i < pres.length; i++) {{
+        for (var i = 0; i < pres.length; i++) {
             var pre = pres[i];
-            if (pre.className.indexOf('mdui-shadow-1') === -1) {{
+            if (pre.className.indexOf('mdui-shadow-1') === -1) {
                 pre.className += ' mdui-shadow-1';
-            }}
-        }}
+            }
+        }
         
         var btn = document.createElement('button');
         btn.className = 'mdui-fab mdui-color-theme-accent mdui-ripple theme-switch';
@@ -541,98 +601,88 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         btn.onclick = toggleTheme;
         document.body.appendChild(btn);
         
-        try {{
-            if (typeof mdui !== 'undefined') {{
+        try {
+            if (typeof mdui !== 'undefined') {
                 mdui.mutation();
                 
-                if (mdui.Appbar) {{
+                if (mdui.Appbar) {
                     new mdui.Appbar('.mdui-appbar');
-                }}
-            }}
-        }} catch(e) {{
+                }
+            }
+        } catch(e) {
             console.error('MDUI init err:', e);
-        }}
+        }
 
-        if (isIE()) {{
+        if (isIE()) {
             var copyBtns = document.querySelectorAll('.copy-btn');
-            for (var i = 0; i < copyBtns.length; i++) {{
+            for (var i = 0; i < copyBtns.length; i++) {
                 copyBtns[i].style.display = 'block';
-            }}
+            }
             
             var appbar = document.querySelector('.mdui-appbar');
-            if (appbar) {{
+            if (appbar) {
                 appbar.style.position = 'fixed';
                 appbar.style.top = '0';
                 appbar.style.width = '100%';
                 appbar.style.zIndex = '1000';
-            }}
-        }}
+            }
+        }
         
         setupAppbarObserver();
         
         var urlElement = document.getElementById('current-url');
-        if (urlElement) {{
+        if (urlElement) {
             urlElement.innerText = window.location.href;
-        }}
+        }
 
-        var titles = document.querySelectorAll('h1, h2, h3, h4, h5, h6');
+        // The list itself is generated at build time, only close the
+        // drawer after a jump on narrow screens.
         var tocList = document.getElementById('toc-list');
-        
-        if (tocList && titles.length > 0) {{
-            titles.forEach(function(title) {{
-                var level = parseInt(title.tagName.charAt(1));
-                var item = document.createElement('a');
-                item.className = 'mdui-list-item mdui-ripple';
-                item.style.paddingLeft = (level * 16) + 'px';
-                item.innerHTML = '<div class="mdui-list-item-content">' + title.textContent + '</div>';
-                
-                if (!title.id) {{
-                    title.id = 'toc-' + title.textContent.replace(/[^a-zA-Z0-9]/g, '-').toLowerCase();
-                }}
-                item.href = '#' + title.id;
-                
-                item.onclick = function() {{
-                    if (window.innerWidth <= 1024) {{
-                        toggleToc();
-                    }}
-                }};
-                tocList.appendChild(item);
-            }});
-        }}
-    }});
+        if (tocList) {
+            tocList.onclick = function(e) {
+                var target = (e || window.event).target || window.event.srcElement;
+                while (target && target !== tocList && target.tagName !== 'A') {
+                    target = target.parentNode;
+                }
+                if (target && target !== tocList && window.innerWidth <= 1024) {
+                    toggleToc();
+                }
+            };
+        }
+    });
     
-    window.addEventListener('resize', function() {{
+    window.addEventListener('resize', function() {
         updateAppbarHeight();
-    }});
+    });
     
-    if (window.matchMedia) {{
-        try {{
+    if (window.matchMedia) {
+        try {
             var darkModeQuery = window.matchMedia('(prefers-color-scheme: dark)');
-            var darkModeHandler = function(e) {{
-                if (e.matches) {{
+            var darkModeHandler = function(e) {
+                if (e.matches) {
                     document.body.className += ' mdui-theme-layout-dark';
-                }} else {{
+                } else {
                     document.body.className = document.body.className.replace(/mdui-theme-layout-dark/g, '').trim();
-                }}
-            }};
+                }
+            };
             
-            if (darkModeQuery.addListener) {{
+            if (darkModeQuery.addListener) {
                 darkModeQuery.addListener(darkModeHandler);
-            }} else if (darkModeQuery.addEventListener) {{
+            } else if (darkModeQuery.addEventListener) {
                 darkModeQuery.addEventListener('change', darkModeHandler);
-            }}
-        }} catch(e) {{
+            }
+        } catch(e) {
             console.error('media query err:', e);
-        }}
-    }}
+        }
+    }
     
-    function copyUrl() {{
+    function copyUrl() {
         var url = window.location.href;
-        if (window.clipboardData && window.clipboardData.setData) {{
+        if (window.clipboardData && window.clipboardData.setData) {
             clipboardData.setData("Text", url);
             showSnackbar('Copied!');
             return;
-        }}
+        }
         
         var textArea = document.createElement("textarea");
         textArea.value = url;
@@ -641,22 +691,235 @@ HTML_TEMPLATE = """<!DOCTYPE html>
         document.body.appendChild(textArea);
         textArea.select();
         
-        try {{
+        try {
             document.execCommand('copy');
             showSnackbar('Copied!');
-        }} catch (err) {{
+        } catch (err) {
             console.error('Copy failed:', err);
             showSnackbar('Failed to copy, please copy manually.');
-        }}
+        }
         
         document.body.removeChild(textArea);
-    }}
+    }
     
-    function toggleToc() {{
+    function toggleToc() {
         var drawer = new mdui.Drawer('#toc-drawer');
         drawer.toggle();
-    }}
-    </script>
+    }
+"""
+
+SEARCH_CSS = """
+        .site-search { position: relative; display: flex; align-items: center; margin-right: 8px; }
+        .site-search input { width: 160px; border: none; border-radius: 4px; padding: 4px 8px; margin-left: 4px; background: rgba(255, 255, 255, 0.2); color: inherit; outline: none; font-size: 14px; }
+        .site-search input::placeholder { color: rgba(255, 255, 255, 0.7); }
+        .site-search-results { display: none; position: absolute; top: 100%; right: 0; width: 320px; max-width: 90vw; max-height: 60vh; overflow-y: auto; background: #fff; color: rgba(0, 0, 0, 0.87); border-radius: 4px; }
+        .site-search-results.open { display: block; }
+        .mdui-theme-layout-dark .site-search-results { background: #303030; color: #fff; }
+        @media (max-width: 600px) { .site-search input { width: 96px; } }
+"""
+
+SEARCH_JS = """
+    // Client side of the build-time search index: the query is tokenized
+    // exactly like search_terms() in format.py, then only docs.json and the
+    // shards for the query terms are fetched.
+    ready(function() {
+        var input = document.getElementById('site-search-input');
+        var results = document.getElementById('site-search-results');
+        if (!input || !results) return;
+        var SEPARATORS = /*SEPARATORS*/;
+        var CJK = /*CJK*/;
+        var LIMIT = 20;
+        var loaded = {};
+        var current = 0;
+        var timer = null;
+        var lastQuery = '';
+
+        function inRanges(c, ranges) {
+            for (var i = 0; i < ranges.length; i++) {
+                if (c >= ranges[i][0] && c <= ranges[i][1]) return true;
+            }
+            return false;
+        }
+
+        function tokenize(text) {
+            var terms = [], run = '', cjk = false;
+            function flush() {
+                if (cjk && run.length > 1) {
+                    for (var i = 0; i + 1 < run.length; i++) terms.push(run.substr(i, 2));
+                } else if (run) {
+                    terms.push(run);
+                }
+                run = '';
+            }
+            text = text.toLowerCase();
+            for (var i = 0; i < text.length; i++) {
+                var c = text.charCodeAt(i);
+                if (inRanges(c, SEPARATORS)) {
+                    flush();
+                    continue;
+                }
+                var isCJK = inRanges(c, CJK);
+                if (run && isCJK !== cjk) flush();
+                cjk = isCJK;
+                run += text.charAt(i);
+            }
+            flush();
+            return terms;
+        }
+
+        function shardOf(term) {
+            var c = term.charCodeAt(0);
+            return c < 128 ? ('0' + c.toString(16)).slice(-2) : 'u' + (c >> 4).toString(16);
+        }
+
+        function fetchJSON(name, done) {
+            var entry = loaded[name];
+            if (entry && entry.waiting === null) {
+                done(entry.data);
+                return;
+            }
+            if (entry) {
+                entry.waiting.push(done);
+                return;
+            }
+            entry = loaded[name] = {data: null, waiting: [done]};
+            var xhr = new XMLHttpRequest();
+            xhr.open('GET', '/search/' + name + '.json');
+            xhr.onreadystatechange = function() {
+                if (xhr.readyState !== 4) return;
+                if (xhr.status === 200) {
+                    try { entry.data = JSON.parse(xhr.responseText); } catch (e) {}
+                }
+                var waiting = entry.waiting;
+                entry.waiting = null;
+                for (var i = 0; i < waiting.length; i++) waiting[i](entry.data);
+            };
+            xhr.send();
+        }
+
+        function rank(terms, shards) {
+            // every term must match; the last one may be a prefix of a
+            // longer term, so results show up while typing
+            var scores = null;
+            for (var i = 0; i < terms.length; i++) {
+                var shard = shards[shardOf(terms[i])] || {}, found = {}, term, id;
+                for (term in shard) {
+                    if (!shard.hasOwnProperty(term)) continue;
+                    if (term === terms[i] || (i === terms.length - 1 && term.indexOf(terms[i]) === 0)) {
+                        var postings = shard[term];
+                        for (var j = 0; j < postings.length; j += 2) {
+                            found[postings[j]] = (found[postings[j]] || 0) + postings[j + 1];
+                        }
+                    }
+                }
+                if (scores === null) {
+                    scores = found;
+                } else {
+                    for (id in scores) {
+                        if (found[id] === undefined) delete scores[id];
+                        else scores[id] += found[id];
+                    }
+                }
+            }
+            var ids = [];
+            for (id in scores) ids.push(id);
+            ids.sort(function(a, b) { return scores[b] - scores[a]; });
+            return ids.slice(0, LIMIT);
+        }
+
+        function show(ids, docs) {
+            results.innerHTML = '';
+            for (var i = 0; i < ids.length; i++) {
+                var doc = docs && docs[ids[i]];
+                if (!doc) continue;
+                var link = document.createElement('a');
+                link.className = 'mdui-list-item mdui-ripple';
+                link.href = doc[0];
+                var text = document.createElement('div');
+                text.className = 'mdui-list-item-content';
+                text.appendChild(document.createTextNode(doc[1]));
+                link.appendChild(text);
+                results.appendChild(link);
+            }
+            if (!results.firstChild && input.value) {
+                var empty = document.createElement('div');
+                empty.className = 'mdui-list-item';
+                empty.appendChild(document.createTextNode('无结果'));
+                results.appendChild(empty);
+            }
+            results.className = results.className.replace(/ open/g, '') + (results.firstChild ? ' open' : '');
+        }
+
+        function search(query) {
+            var terms = tokenize(query), token = ++current;
+            if (!terms.length) {
+                show([], null);
+                return;
+            }
+            var names = ['docs'], shards = {}, i;
+            for (i = 0; i < terms.length; i++) names.push(shardOf(terms[i]));
+            var left = names.length;
+            for (i = 0; i < names.length; i++) {
+                (function(name) {
+                    fetchJSON(name, function(data) {
+                        shards[name] = data;
+                        if (--left === 0 && token === current) {
+                            show(rank(terms, shards), shards.docs);
+                        }
+                    });
+                })(names[i]);
+            }
+        }
+
+        input.onkeyup = input.oninput = function(e) {
+            if ((e || window.event).keyCode === 27) {
+                input.value = '';
+            }
+            if (input.value === lastQuery) return;
+            lastQuery = input.value;
+            clearTimeout(timer);
+            timer = setTimeout(function() { search(lastQuery); }, 150);
+        };
+        input.onfocus = function() {
+            if (results.firstChild && input.value) results.className += ' open';
+        };
+        input.onblur = function() {
+            // let a click on a result land first
+            setTimeout(function() { results.className = results.className.replace(/ open/g, ''); }, 200);
+        };
+    });
+""".replace('/*SEPARATORS*/', json.dumps(
+    [[a, min(b, 0xffff)] for a, b in SEARCH_SEPARATOR_RANGES])).replace('/*CJK*/', json.dumps(SEARCH_CJK_RANGES))
+
+# Dropped into the appbar when the search index is enabled
+SEARCH_HTML = """<div class="site-search" id="site-search">
+                <i class="mdui-icon material-icons">&#xe8b6;</i>
+                <input id="site-search-input" type="search" placeholder="搜索" autocomplete="off">
+                <div class="mdui-list site-search-results mdui-shadow-4" id="site-search-results"></div>
+            </div>
+            """
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta http-equiv="X-UA-Compatible" content="IE=edge">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <meta name="google" content="notranslate" />
+    <title>{{ title }}</title>{{ head }}
+    <link rel="icon" href="/favicon.png" type="image/png">
+    <link rel="shortcut icon" href="/favicon.png" type="image/png">
+    <!-- MDUI CSS -->
+    <link rel="stylesheet" href="https://unpkg.com/mdui@1.0.2/dist/css/mdui.min.css" onerror="this.onerror=null;this.href='https://cdnjs.cloudflare.com/ajax/libs/mdui/1.0.2/css/mdui.min.css';">
+    {{ styles }}
+    <!--[if IE]>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/es6-promise/4.2.8/es6-promise.auto.min.js"></script>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/html5shiv/3.7.3/html5shiv.min.js"></script>
+    <script src="https://gcore.jsdelivr.net/npm/classlist-polyfill@1.2.0/src/index.min.js"></script>
+    <script src="https://gcore.jsdelivr.net/npm/eligrey-classlist-js-polyfill@1.2.20171210/classList.min.js"></script>
+    <![endif]-->
+    <script src="https://unpkg.com/mdui@1.0.2/dist/js/mdui.min.js" onerror="this.onerror=null;this.src='https://cdnjs.cloudflare.com/ajax/libs/mdui/1.0.2/js/mdui.min.js';"></script>
+    {{ scripts }}
 </head>
 <body class="mdui-theme-primary-indigo mdui-theme-accent-blue">
     <div class="mdui-appbar mdui-appbar-fixed">
@@ -664,9 +927,9 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             <button class="mdui-btn mdui-btn-icon toc-btn" onclick="toggleToc()">
                 <i class="mdui-icon material-icons">&#xe5d2;</i>
             </button>
-            <a href="javascript:;" class="mdui-typo-headline">{title}</a>
+            <a href="javascript:;" class="mdui-typo-headline">{{ title }}</a>
             <div class="mdui-toolbar-spacer"></div>
-            <button class="mdui-btn mdui-btn-icon" mdui-menu="{{target: '#langMenu'}}">
+            {{ search }}<button class="mdui-btn mdui-btn-icon" mdui-menu="{target: '#langMenu'}">
                 <i class="mdui-icon material-icons">&#xe8e2;</i>
             </button>
             <ul class="mdui-menu" id="langMenu">
@@ -713,23 +976,24 @@ HTML_TEMPLATE = """<!DOCTYPE html>
     <div class="mdui-drawer mdui-drawer-close" id="toc-drawer">
         <div class="mdui-card">
             <div class="mdui-card-primary">
-                <div class="mdui-card-primary-title">{title}</div>
+                <div class="mdui-card-primary-title">{{ title }}</div>
                 <div class="mdui-card-primary-subtitle" onclick="copyUrl()" id="current-url"></div>
             </div>
         </div>
         <div class="mdui-list" id="toc-list">
+{{ toc }}
         </div>
     </div>
     
     <div class="mdui-container mdui-typo mdui-container-with-appbar">
-        {content}
+        {{ content }}
     </div>
 <script src="https://cdn.staticfile.net/translate.js/3.12.0/translate.js" onerror="this.onerror=null;this.src='https://sharepoint.cf.stevezmt.top/js/3rd-party/translate.min.js';"></script>
 <script>
-setTimeout(function() {{
+setTimeout(function() {
     var isTranslated = 0;
-    if (typeof translate !== 'undefined') {{
-        try {{
+    if (typeof translate !== 'undefined') {
+        try {
             translate.language.setLocal('chinese_simplified');
             translate.selectLanguageTag.show = false;
             translate.ignore.tag.push('tbody');
@@ -741,74 +1005,3503 @@ setTimeout(function() {{
             translate.service.use('client.edge');
             showTranslateComplete(translate.language.getCurrent());
             translate.execute();
-        }} catch(e) {{
+        } catch(e) {
             console.error('Translate err:', e);
-        }}
-    }}
-}}, 500);
-translate.listener.renderTaskFinish = function(task){{
+        }
+    }
+}, 500);
+translate.listener.renderTaskFinish = function(task){
     showTranslateComplete(translate.language.getCurrent());
-}}
+}
 </script>
 </html>
 """
 
-def add_copy_buttons(soup):
-    for pre in soup.find_all('pre'):
-        button = soup.new_tag('button')
-        icon = soup.new_tag('i')
-        icon['class'] = 'mdui-icon material-icons'
-        icon.append("\ue14d")  # Using Unicode character directly instead of HTML entity
-        button.append(icon)
-        button['class'] = 'copy-btn mdui-btn mdui-btn-icon mdui-ripple'
-        button['onclick'] = 'copyText(this)'
-        pre.insert(0, button)
-    return soup
-
-def convert_markdown_file(input_path):
-    with open(input_path, 'r', encoding='utf-8') as f:
-        text = f.read()
-    
-    html = markdown.markdown(text, 
-                           extensions=['fenced_code', 
-                                     'tables', 
-                                     'nl2br',
-                                     'sane_lists',
-                                     'attr_list',
-                                     'def_list',
-                                     'admonition'])
+# Pages without the MDUI/translate.js scripts (front matter: layout: light);
+# the TOC is a plain <details> list and only copying code needs script.
+LIGHT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ title }}</title>{{ head }}
+    <link rel="icon" href="/favicon.png" type="image/png">
+    <link rel="stylesheet" href="https://unpkg.com/mdui@1.0.2/dist/css/mdui.min.css" onerror="this.onerror=null;this.href='https://cdnjs.cloudflare.com/ajax/libs/mdui/1.0.2/css/mdui.min.css';">
+    {{ styles }}
+    <style>
+        .light-toc { margin: 1rem 0; }
+        .light-toc summary { cursor: pointer; font-weight: 500; }
+    </style>
+    {{ scripts }}
+</head>
+<body class="mdui-theme-primary-indigo mdui-theme-accent-blue">
+    <div class="mdui-container mdui-typo">
+        <details class="light-toc">
+            <summary>目录</summary>
+            <div class="mdui-list">
+{{ toc }}
+            </div>
+        </details>
+        {{ content }}
+    </div>
+</body>
+</html>
+"""
+
+LIGHT_JS = """
+    function copyText(btn) {
+        var code = btn.parentNode.querySelector('code');
+        var text = code ? (code.innerText || code.textContent) : '';
+        if (navigator.clipboard) {
+            navigator.clipboard.writeText(text).then(function() {
+                btn.className += ' copy-success';
+                setTimeout(function() {
+                    btn.className = btn.className.replace(/ copy-success/g, '');
+                }, 1500);
+            });
+        }
+    }
     
-    soup = BeautifulSoup(html, 'html.parser')
-    soup = add_copy_buttons(soup)
+    (function() {
+        var root = document.documentElement;
+        if ('ontouchstart' in window) {
+            root.className += ' touch-device';
+        }
+        if (window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches) {
+            root.className += ' mdui-theme-layout-dark';
+        }
+    })();
+"""
+
+LAYOUTS = {'default': HTML_TEMPLATE, 'light': LIGHT_TEMPLATE}
+
+# Appended to the page script of every layout with --service-worker
+SW_REGISTER_JS = """
+    if ('serviceWorker' in navigator && location.protocol !== 'file:') {
+        window.addEventListener('load', function() {
+            navigator.serviceWorker.register('/sw.js').catch(function(e) {
+                console.error('Service worker err:', e);
+            });
+        });
+    }
+"""
+
+# <root>/sw.js; /*PRECACHE*/ becomes {url: content hash} of the shared
+# assets and /*PAGES*/ the same for the pages, at build time. Install
+# fetches the assets plus the pages open right now, other pages are cached
+# on their first visit. Entries are stored under their hash, so a new
+# manifest (any page or asset changed) makes the browser install a worker
+# that fetches only the assets whose hash differs, and whose activation
+# drops every entry with an outdated hash.
+SERVICE_WORKER_JS = SERVICE_WORKER_MARKER + """
+var PRECACHE = /*PRECACHE*/;
+var PAGES = /*PAGES*/;
+var CACHE = 'mdui-precache';
+var CONCURRENCY = 6;
+
+function version(key) {
+    if (PRECACHE.hasOwnProperty(key)) return PRECACHE[key];
+    if (PAGES.hasOwnProperty(key)) return PAGES[key];
+    return null;
+}
+
+function storedKey(key) {
+    return key + '?__v=' + encodeURIComponent(version(key));
+}
+
+function cacheKey(url) {
+    // same-origin URLs by path ('/guide/index.html' is '/guide/'),
+    // the CDN files by full URL
+    var u = new URL(url, self.location.href);
+    if (u.origin !== self.location.origin) return u.origin + u.pathname;
+    return u.pathname.replace(/\\/index\\.html$/, '/');
+}
+
+function fetchEntry(cache, url) {
+    // reload: the HTTP cache may still hold the bytes of the old hash
+    var request = url.charAt(0) === '/' ? new Request(url, {cache: 'reload'})
+                                        : new Request(url, {mode: 'no-cors'});
+    return fetch(request).then(function(response) {
+        if (!response.ok && response.type !== 'opaque') throw new Error(url + ': ' + response.status);
+        if (!response.redirected) return response;
+        // a redirected response cannot answer a navigation
+        return response.blob().then(function(body) {
+            return new Response(body, {status: response.status, statusText: response.statusText,
+                                       headers: response.headers});
+        });
+    }).then(function(response) {
+        return cache.put(storedKey(url), response);
+    });
+}
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(Promise.all([
+        caches.open(CACHE),
+        self.clients.matchAll({type: 'window', includeUncontrolled: true})
+    ]).then(function(results) {
+        var cache = results[0];
+        var urls = Object.keys(PRECACHE);
+        // the page that registered us is worth having offline too
+        results[1].forEach(function(client) {
+            var key = cacheKey(client.url);
+            if (PAGES.hasOwnProperty(key) && urls.indexOf(key) < 0) urls.push(key);
+        });
+        return Promise.all(urls.map(function(url) {
+            return cache.match(storedKey(url)).then(function(response) {
+                return response ? null : url;
+            });
+        })).then(function(missing) {
+            var stale = missing.filter(function(url) { return url !== null; });
+            // a failed entry is fetched again on its next visit
+            function next() {
+                var url = stale.shift();
+                if (url === undefined) return Promise.resolve();
+                return fetchEntry(cache, url).catch(function(e) {
+                    console.error('Precache err:', e);
+                }).then(next);
+            }
+            var workers = [];
+            for (var i = 0; i < CONCURRENCY; i++) workers.push(next());
+            return Promise.all(workers);
+        });
+    }).then(function() {
+        return self.skipWaiting();
+    }));
+});
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(caches.open(CACHE).then(function(cache) {
+        return cache.keys().then(function(requests) {
+            return Promise.all(requests.filter(function(request) {
+                var v = new URL(request.url).searchParams.get('__v');
+                return v !== version(cacheKey(request.url));
+            }).map(function(request) {
+                return cache.delete(request);
+            }));
+        });
+    }).then(function() {
+        return self.clients.claim();
+    }));
+});
+
+self.addEventListener('fetch', function(event) {
+    if (event.request.method !== 'GET') return;
+    var key = cacheKey(event.request.url);
+    if (version(key) === null) return;
+    var stored = storedKey(key);
+    event.respondWith(caches.open(CACHE).then(function(cache) {
+        return cache.match(stored).then(function(response) {
+            if (response) return response;
+            return fetch(event.request).then(function(response) {
+                // a redirected response cannot answer a navigation
+                if (response.ok && !response.redirected && PAGES.hasOwnProperty(key)) {
+                    cache.put(stored, response.clone());
+                }
+                return response;
+            });
+        });
+    }));
+});
+"""
+
+# Replaces our sw.js once --service-worker is switched off: browsers that
+# installed the old worker fetch this one on their next visit, and it
+# removes the cache and itself.
+SERVICE_WORKER_RETIRE_JS = SERVICE_WORKER_MARKER + """
+self.addEventListener('install', function() {
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(caches.delete('mdui-precache').then(function() {
+        return self.registration.unregister();
+    }));
+});
+"""
+
+COPY_ICON = "\ue14d"  # Using Unicode character directly instead of HTML entity
+COPY_BUTTON_HTML = ('<button class="copy-btn mdui-btn mdui-btn-icon mdui-ripple" onclick="copyText(this)">'
+                    '<i class="mdui-icon material-icons">' + COPY_ICON + '</i></button>')
+
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+TOC_ID_PREFIX = 'toc-'
+_ASCII_ALNUM = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+
+class DependencyError(ImportError):
+    pass
+
+def import_markdown():
+    # Never installs anything on its own: fail fast with a clear message
+    try:
+        import markdown
+    except ImportError as e:
+        raise DependencyError('需要 Python-Markdown，请先安装: pip install markdown') from e
+    return markdown
+
+_pil_missing_reported = False
+
+def import_pil():
+    # Only needed for --image-widths; without it pages just get no srcset
+    global _pil_missing_reported
+    try:
+        from PIL import Image
+    except ImportError:
+        if not _pil_missing_reported:
+            _pil_missing_reported = True
+            print('未安装 Pillow (pip install pillow)，跳过响应式图片')
+        return None
+    return Image
+
+def import_pygments():
+    # Only needed with --highlight
+    try:
+        import pygments
+    except ImportError as e:
+        raise DependencyError('--highlight 需要 Pygments，请先安装: pip install pygments') from e
+    return pygments
+
+_PRE_TAG_RE = re.compile(r'<pre\b[^>]*>', re.IGNORECASE)
+_ESCAPED_CHAR_RE = re.compile('\x02([0-9]+)\x03')
+_HTML_TAG_RE = re.compile(r'<[^>]*>')
+# Same pattern as markdown.util.HTML_PLACEHOLDER_RE, without importing markdown
+_HTML_PLACEHOLDER_RE = re.compile('\x02wzxhzdk:([0-9]+)\x03')
+_JPEG_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+_VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+                        'meta', 'param', 'source', 'track', 'wbr'])
+
+def _char_class(ranges):
+    return ''.join(re.escape(chr(a)) + '-' + re.escape(chr(b)) for a, b in ranges)
+
+# Patterns of the optional features (search, link checking, front matter,
+# images, sections, the site index), compiled by _pattern() on first use so
+# that start-up does not pay for features a run never touches.
+_PATTERNS = {
+    # A stashed fenced_code block with a language, e.g.
+    # <pre id="x"><code class="language-python">...</code></pre>
+    'fenced_code': (r'<pre([^>]*)><code class="language-([^"\s]+)"([^>]*)>(.*?)</code></pre>',
+                    re.DOTALL),
+    'class_attr': (r'\bclass="([^"]*)"', 0),
+    'url_scheme': (r'^[a-zA-Z][a-zA-Z0-9+.-]*:', 0),
+    'raw_id': (r'\bid\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE),
+    'raw_href': (r'<a\b[^>]*?\bhref\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE),
+    'id_attr': (r'(?<![\w-])id="([^"]*)"', 0),
+    # Section splitting (see split_sections)
+    'section_heading': (r'#{1,2}(?!#)', 0),
+    'fence_open': (r'(`{3,}|~{3,})', 0),
+    'raw_block': (r'<([a-zA-Z][\w-]*)', 0),
+    'ref_def': (r'[ ]{0,3}\[([^\[\]]+)\]:', 0),
+    'slot': (r'\{\{\s*([a-z_]+)\s*\}\}', 0),
+    'front_matter': (r'\A(---|\+\+\+)[ \t]*\r?\n(.*?)\r?\n\1[ \t]*(?:\r?\n|\Z)', re.DOTALL),
+    # Python-Markdown's rule: no space needed after the hashes
+    'atx_heading': (r'(#{1,6})[ \t]*(.*?)[ \t]*#*[ \t]*$', 0),
+    'setext': (r' {0,3}(=+|-+)[ \t]*$', 0),
+    'not_paragraph': (r'(?: {4}|\t| {0,3}(?:[<|>]|!!!|[-*+][ \t]|\d+[.)][ \t]|\[[^\]]+\]:'
+                      r'|[-*_](?:[ \t]*[-*_]){2,}[ \t]*$))', 0),
+    'md_image': (r'!\[[^\]]*\]\([^)]*\)|!\[[^\]]*\]\[[^\]]*\]', 0),
+    'md_link': (r'\[([^\]]*)\](?:\([^)]*\)|\[[^\]]*\])', 0),
+    'md_code': (r'(`+)(.+?)\1', 0),
+    'md_emphasis': (r'(\*{1,3}|_{1,3})(?=\S)(.+?)(?<=\S)\1', 0),
+    'md_escape': (r'\\([\\`*_{}\[\]()#+\-.!])', 0),
+    'script_style': (r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL),
+    'search_token': (f'([{_char_class(SEARCH_CJK_RANGES)}]+)'
+                     f'|([^{_char_class(SEARCH_SEPARATOR_RANGES)}{_char_class(SEARCH_CJK_RANGES)}]+)', 0),
+}
+
+@functools.lru_cache(maxsize=None)
+def _pattern(name):
+    source, flags = _PATTERNS[name]
+    return re.compile(source, flags)
+
+def element_text(md, el):
+    # Plain text of an element as the browser would show it: backslash escapes
+    # and stashed inline HTML/entities are resolved, tags are dropped.
+    text = ''.join(el.itertext())
+    text = _ESCAPED_CHAR_RE.sub(lambda m: chr(int(m.group(1))), text)
+
+    def unstash(m):
+        index = int(m.group(1))
+        if index >= len(md.htmlStash.rawHtmlBlocks):
+            return ''
+        raw = str(md.htmlStash.rawHtmlBlocks[index])
+        return html.unescape(_HTML_TAG_RE.sub('', raw))
+    return _HTML_PLACEHOLDER_RE.sub(unstash, text)
+
+def make_copy_button():
+    import xml.etree.ElementTree as etree
+    button = etree.Element('button')
+    button.set('class', 'copy-btn mdui-btn mdui-btn-icon mdui-ripple')
+    button.set('onclick', 'copyText(this)')
+    icon = etree.SubElement(button, 'i')
+    icon.set('class', 'mdui-icon material-icons')
+    icon.text = COPY_ICON
+    return button
+
+def heading_slug(text):
+    # Same ids the old client-side TOC produced for ASCII headings
+    # ('toc-' + every non-alphanumeric char replaced by '-'), but CJK and
+    # other letters are kept instead of collapsing to a row of dashes.
+    return TOC_ID_PREFIX + ''.join(
+        c.lower() if (c.isalnum() if ord(c) > 127 else c in _ASCII_ALNUM) else '-'
+        for c in text)
+
+def unique_id(base, used):
+    candidate = base
+    n = 1
+    while candidate in used:
+        candidate = f'{base}-{n}'
+        n += 1
+    used.add(candidate)
+    return candidate
+
+def search_terms(text, counts=None, weight=1):
+    # Term frequencies of plain text: lower-cased words, and overlapping
+    # bigrams for CJK runs (a lone CJK character is kept as is). Mirrors
+    # tokenize() in SEARCH_JS.
+    counts = {} if counts is None else counts
+    for cjk, word in _pattern('search_token').findall(text.lower()):
+        if len(cjk) > 1:
+            for i in range(len(cjk) - 1):
+                term = cjk[i:i + 2]
+                counts[term] = counts.get(term, 0) + weight
+        else:
+            term = cjk or word
+            counts[term] = counts.get(term, 0) + weight
+    return counts
+
+def page_text(content):
+    # Visible text of rendered page content, for the search index
+    content = _pattern('script_style').sub(' ', content)
+    return html.unescape(_HTML_TAG_RE.sub(' ', content))
+
+def split_sections(text):
+    # Cuts a document before every # / ## ATX heading that starts a block
+    # outside fenced code, raw HTML blocks and comments, so that every
+    # section renders on its own exactly as it does inside the whole
+    # document. Reference definitions a section may use are appended to it.
+    lines = text.split('\n')
+    starts = [0]
+    refs = []
+    blank = True
+    for i, (line, kind) in enumerate(block_kinds(lines)):
+        if kind is not None:
+            pass
+        elif _pattern('ref_def').match(line):
+            definition = [line]
+            # the URL or the title may sit on the next line
+            if i + 1 < len(lines) and (not line.split(':', 1)[1].strip()
+                                       or lines[i + 1][:1] == ' '):
+                definition.append(lines[i + 1])
+            refs.append((_pattern('ref_def').match(line).group(1).strip().lower(), '\n'.join(definition)))
+        elif blank and i and _pattern('section_heading').match(line):
+            starts.append(i)
+        blank = not line.strip()
+    starts.append(len(lines))
+    sections = []
+    for begin, end in zip(starts, starts[1:]):
+        section = '\n'.join(lines[begin:end])
+        lowered = section.lower()
+        used = [definition for label, definition in refs if label in lowered]
+        if used:
+            section += '\n\n' + '\n'.join(used) + '\n'
+        sections.append(section)
+    return sections
+
+def block_kinds(lines):
+    # (line, kind) for every line of a Markdown source: kind is 'code' for
+    # fenced code (fences included), 'html' for raw HTML blocks and
+    # comments, None for the lines Markdown itself parses
+    fence = None
+    raw_tag = None
+    depth = 0
+    comment = False
+    for line in lines:
+        if fence is not None:
+            if line.rstrip(' ') == fence:
+                fence = None
+            yield line, 'code'
+        elif comment:
+            comment = '-->' not in line
+            yield line, 'html'
+        elif raw_tag is not None:
+            depth += _tag_balance(raw_tag, line)
+            if depth <= 0:
+                raw_tag = None
+            yield line, 'html'
+        elif _pattern('fence_open').match(line):
+            fence = _pattern('fence_open').match(line).group(1)
+            yield line, 'code'
+        elif line.startswith('<!--'):
+            comment = '-->' not in line
+            yield line, 'html'
+        elif _pattern('raw_block').match(line):
+            tag = _pattern('raw_block').match(line).group(1).lower()
+            if tag not in _VOID_TAGS:
+                depth = _tag_balance(tag, line)
+                raw_tag = tag if depth > 0 else None
+            yield line, 'html'
+        else:
+            yield line, None
+
+def _tag_balance(tag, line):
+    lowered = line.lower()
+    return (len(re.findall(r'<' + re.escape(tag) + r'[\s>/]', lowered + ' '))
+            - len(re.findall(r'</' + re.escape(tag) + r'\s*>', lowered)))
+
+class Template:
+    # A layout parsed once into static chunks and slot names; render()
+    # just interleaves them with the page values, ready for writelines.
+    # Slots are written {{ name }}, so CSS and JS braces need no escaping.
+
+    def __init__(self, source):
+        parts = _pattern('slot').split(source)
+        self.chunks = parts[0::2]
+        self.slots = parts[1::2]
+
+    def render(self, values):
+        pieces = [self.chunks[0]]
+        for slot, chunk in zip(self.slots, self.chunks[1:]):
+            pieces.append(values.get(slot, ''))
+            pieces.append(chunk)
+        return pieces
+
+@functools.lru_cache(maxsize=None)
+def get_layout(name):
+    try:
+        return Template(LAYOUTS[name])
+    except KeyError:
+        raise ValueError(f'未知的布局: {name} (可用: {", ".join(LAYOUTS)})') from None
+
+def parse_front_matter(text):
+    # Returns (metadata, body) for a leading YAML (---) or TOML (+++) block.
+    # Text without one, or whose block is not a mapping (e.g. two horizontal
+    # rules), comes back unchanged with {}.
+    m = _pattern('front_matter').match(text)
+    if not m:
+        return {}, text
+    fence, source = m.groups()
+    try:
+        meta = _parse_toml(source) if fence == '+++' else _parse_yaml(source)
+    except ValueError:
+        return {}, text
+    if not isinstance(meta, dict):
+        return {}, text
+    return meta, text[m.end():]
+
+def _parse_yaml(source):
+    try:
+        import yaml
+    except ImportError:
+        return _parse_simple(source, ':')
+    try:
+        return yaml.safe_load(source)
+    except yaml.YAMLError as e:
+        raise ValueError(str(e)) from e
+
+def _parse_toml(source):
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        try:
+            import tomli as tomllib
+        except ImportError:
+            return _parse_simple(source, '=')
+    try:
+        return tomllib.loads(source)
+    except tomllib.TOMLDecodeError as e:
+        raise ValueError(str(e)) from e
+
+def _parse_simple(source, sep):
+    # Flat "key: value" / "key = value" pairs, enough for title, layout,
+    # description and noindex when PyYAML / tomli are not installed
+    meta = {}
+    for line in source.splitlines():
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        if sep not in line or line[0].isspace():
+            raise ValueError(f'unsupported front matter line: {line}')
+        key, value = (part.strip() for part in line.split(sep, 1))
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        elif value.lower() in ('true', 'yes', 'on'):
+            value = True
+        elif value.lower() in ('false', 'no', 'off'):
+            value = False
+        meta[key] = value
+    return meta
+
+def head_tags(meta):
+    tags = []
+    if meta.get('description'):
+        tags.append(f'<meta name="description" content="{html.escape(str(meta["description"]))}">')
+    if meta.get('noindex'):
+        tags.append('<meta name="robots" content="noindex">')
+    return ''.join('\n    ' + tag for tag in tags)
+
+def is_local_url(url):
+    # Links into this site (relative, root-relative or a bare #fragment)
+    return bool(url) and not url.startswith('//') and not _pattern('url_scheme').match(url)
+
+def search_shard(term):
+    c = ord(term[0])
+    return f'{c:02x}' if c < 128 else f'u{c >> 4:x}'
+
+def toc_html(entries):
+    return '\n'.join(
+        f'            <a class="mdui-list-item mdui-ripple" href="#{html.escape(anchor)}" style="padding-left: {level * 16}px">'
+        f'<div class="mdui-list-item-content">{html.escape(text, quote=False)}</div></a>'
+        for level, anchor, text in entries)
+
+def add_class(attrs, names):
+    # attrs is the attribute string of a start tag, e.g. ' id="x" class="y"'
+    if _pattern('class_attr').search(attrs):
+        return _pattern('class_attr').sub(lambda m: f'class="{names} {m.group(1)}"', attrs, 1)
+    return f' class="{names}"' + attrs
+
+class CodeHighlighter:
+    # Pygments highlighting at build time instead of in the browser. Results
+    # are memoised in memory and, given a cache_dir, on disk as
+    # <cache_dir>/<hh>/<sha256>.html keyed by Pygments version, language and
+    # code, so a rebuild only tokenizes code blocks it has not seen before.
+    # Token classes are style independent; the colours come from
+    # highlight_css().
+
+    def __init__(self, cache_dir=None):
+        self.pygments = import_pygments()
+        from pygments.formatters import HtmlFormatter
+        self.formatter = HtmlFormatter(nowrap=True)
+        self.cache_dir = cache_dir
+        self.lexers = {}
+        self.memo = {}
+        # keys of the results handed out since the caller last cleared it
+        self.used = set()
+
+    def lexer(self, lang):
+        if lang not in self.lexers:
+            from pygments.lexers import get_lexer_by_name
+            from pygments.util import ClassNotFound
+            try:
+                self.lexers[lang] = get_lexer_by_name(lang)
+            except ClassNotFound:
+                self.lexers[lang] = None
+        return self.lexers[lang]
+
+    def highlight(self, lang, code):
+        # Returns the highlighted (still escaped) markup, None if Pygments
+        # does not know the language
+        key = hashlib.sha256(f'{self.pygments.__version__}\0{lang}\0{code}'.encode('utf-8')).hexdigest()
+        if key in self.memo:
+            if self.memo[key] is not None:
+                self.used.add(key)
+            return self.memo[key]
+        path = None
+        result = None
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, key[:2], key + '.html')
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    result = f.read()
+            except OSError:
+                pass
+        if result is None:
+            lexer = self.lexer(lang)
+            if lexer is None:
+                return None
+            result = self.pygments.highlight(code, lexer, self.formatter)
+            if path:
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    _write_file(path, result.encode('utf-8'))
+                except OSError:
+                    pass  # the cache is only an optimisation
+        if len(self.memo) >= HIGHLIGHT_MEMO_SIZE:
+            self.memo.clear()
+        self.memo[key] = result
+        if result is not None:
+            self.used.add(key)
+        return result
+
+def image_size(path):
+    # (width, height) from the header of a PNG, GIF, JPEG or WebP file, None
+    # for anything else; only a few bytes are read and no library is needed
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', head[26:30])
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b'VP8L':
+                b0, b1, b2, b3 = head[21:25]
+                return (1 + (((b1 & 0x3f) << 8) | b0),
+                        1 + (((b3 & 0xf) << 10) | (b2 << 2) | ((b1 & 0xc0) >> 6)))
+            if chunk == b'VP8X':
+                return (1 + int.from_bytes(head[24:27], 'little'),
+                        1 + int.from_bytes(head[27:30], 'little'))
+            return None
+        if head[:2] == b'\xff\xd8':
+            return _jpeg_size(f)
+    return None
+
+def _jpeg_size(f):
+    # Walks the marker segments up to the first SOFn, skipping EXIF and
+    # friends without reading them
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        while marker == b'\xff\xff':  # fill bytes
+            marker = b'\xff' + f.read(1)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        code = marker[1]
+        if code == 0x01 or 0xd0 <= code <= 0xd8:  # segments without a length
+            continue
+        if code in (0xd9, 0xda):  # end of image / start of scan
+            return None
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if code in _JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(struct.unpack('>H', length)[0] - 2, 1)
+
+class ImageProcessor:
+    # Gives local <img> elements their intrinsic width/height (from the file
+    # header, so the page does not shift while images load), lazy loading
+    # and async decoding, and with widths a srcset of downscaled copies
+    # (needs Pillow). Image info is cached by content hash under cache_dir,
+    # variants are written once under content-hashed names, so an image that
+    # did not change costs a stat and a hash on rebuild.
+
+    def __init__(self, root, cache_dir=None, widths=()):
+        self.root = root
+        self.cache_dir = cache_dir
+        self.widths = tuple(sorted(widths))
+        self.memo = {}
+        # content hashes of the images looked at since last cleared
+        self.used = set()
+
+    def resolve(self, src, doc_dir):
+        if not src or src.startswith(('//', '#')) or _pattern('url_scheme').match(src):
+            return None
+        from urllib.parse import unquote
+        path = unquote(src.split('#', 1)[0].split('?', 1)[0])
+        if path.startswith('/'):
+            path = os.path.join(self.root, path.lstrip('/'))
+        else:
+            path = os.path.join(doc_dir, path)
+        return os.path.normpath(path)
+
+    def info(self, path):
+        # Returns ({'size': [w, h] or None, 'variants': {width: url}}, stamp)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        memo_key = (path, st.st_size, st.st_mtime_ns)
+        digest, info = self.memo.get(memo_key, (None, None))
+        if info is not None and not self.drop_missing(info):
+            self.used.add(digest)
+            return info, stamp
+        digest = file_hash(path)
+        cache_path = None
+        info = None
+        if self.cache_dir:
+            cache_path = os.path.join(self.cache_dir, digest[:2], digest + '.json')
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                pass
+        changed = info is None or self.drop_missing(info)
+        if info is None:
+            size = image_size(path)
+            info = {'size': list(size) if size else None, 'variants': {}}
+        if info['size'] and self.widths:
+            changed = self.make_variants(path, digest, info) or changed
+        if changed and cache_path:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                _write_file(cache_path, json.dumps(info, sort_keys=True).encode('utf-8'))
+            except OSError:
+                pass  # the cache is only an optimisation
+        self.memo[memo_key] = digest, info
+        self.used.add(digest)
+        return info, stamp
+
+    def variant_path(self, url):
+        return os.path.join(self.root, url.lstrip('/'))
+
+    def drop_missing(self, info):
+        # Variants deleted since they were recorded (a cleaned assets/img,
+        # say) are forgotten, so make_variants() writes them again
+        missing = [w for w, url in info['variants'].items()
+                   if not os.path.exists(self.variant_path(url))]
+        for w in missing:
+            del info['variants'][w]
+        return bool(missing)
+
+    def make_variants(self, path, digest, info):
+        width, height = info['size']
+        variants = info['variants']
+        wanted = [w for w in self.widths if w < width and str(w) not in variants]
+        ext = os.path.splitext(path)[1].lower()
+        if not wanted or ext not in IMAGE_VARIANT_TYPES:
+            return False
+        Image = import_pil()
+        if Image is None:
+            return False
+        import io
+        with Image.open(path) as im:
+            im.load()
+            for w in wanted:
+                name = f'{digest[:16]}-{w}{ext}'
+                out = os.path.join(self.root, ASSETS_DIR_NAME, IMAGES_DIR_NAME, name)
+                if not os.path.exists(out):
+                    buf = io.BytesIO()
+                    resized = im.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+                    resized.save(buf, format=im.format, quality=85, optimize=True)
+                    os.makedirs(os.path.dirname(out), exist_ok=True)
+                    _write_file(out, buf.getvalue())
+                variants[str(w)] = f'/{ASSETS_DIR_NAME}/{IMAGES_DIR_NAME}/{name}'
+        return True
+
+    def process(self, root, doc_dir, deps, eager=True):
+        # deps receives {path relative to the site root: [size, mtime_ns]}
+        # (None for a missing file) so the page is rebuilt when one changes.
+        # eager=False: an earlier section of the page already had an image.
+        # Returns the number of images.
+        n = 0
+        for n, img in enumerate(root.iter('img'), 1):
+            # the first image is likely above the fold, lazy loading it would
+            # only delay the largest paint
+            if (n > 1 or not eager) and 'loading' not in img.attrib:
+                img.set('loading', 'lazy')
+            if 'decoding' not in img.attrib:
+                img.set('decoding', 'async')
+            path = self.resolve(img.get('src'), doc_dir)
+            if path is None:
+                continue
+            dep = os.path.relpath(path, self.root).replace(os.sep, '/')
+            try:
+                info, deps[dep] = self.info(path)
+            except OSError:
+                deps[dep] = None
+                continue
+            if not info['size']:
+                continue
+            width, height = info['size']
+            if 'width' not in img.attrib and 'height' not in img.attrib:
+                img.set('width', str(width))
+                img.set('height', str(height))
+            variants = sorted((int(w), url) for w, url in info['variants'].items())
+            srcset = [f'{url} {w}w' for w, url in variants if w in self.widths]
+            if srcset and 'srcset' not in img.attrib:
+                srcset.append(f'{img.get("src")} {width}w')
+                img.set('srcset', ', '.join(srcset))
+                img.set('sizes', IMAGE_SIZES)
+                # a variant that goes missing rebuilds the page
+                for w, url in variants:
+                    if w in self.widths:
+                        try:
+                            st = os.stat(self.variant_path(url))
+                            deps[url.lstrip('/')] = [st.st_size, st.st_mtime_ns]
+                        except OSError:
+                            deps[url.lstrip('/')] = None
+        return n
+
+class MduiTreeprocessor:
+    # Runs inside python-markdown's own ElementTree pass, so the rendered
+    # HTML never has to be parsed a second time. The Registry only needs
+    # run(root), so this does not subclass markdown's Treeprocessor and the
+    # module can be imported without markdown installed.
+
+    def __init__(self, md, highlighter=None, images=None):
+        self.md = md
+        self.highlighter = highlighter
+        self.images = images
+        self.doc_dir = '.'
+        self.eager = True
+        self.image_count = 0
+        self.title = None
+        self.toc = []
+        self.deps = {}
+        self.ids = []
+        self.links = []
+        self.explicit = []
+        self.auto = []
+
+    def run(self, root):
+        self.title = None
+        self.toc = []
+        self.deps = {}
+        self.auto = []
+        used = set(el.get('id') for el in root.iter() if el.get('id'))
+        self.explicit = sorted(used)
+        for el in root.iter():
+            if el.tag not in HEADING_TAGS:
+                continue
+            text = element_text(self.md, el)
+            if self.title is None and el.tag == 'h1':
+                self.title = text
+            anchor = el.get('id')
+            if not anchor:
+                base = heading_slug(text.strip())
+                anchor = unique_id(base, used)
+                el.set('id', anchor)
+                self.auto.append((anchor, base))
+            self.toc.append((int(el.tag[1]), anchor, text))
+
+        if self.images is not None:
+            self.image_count = self.images.process(root, self.doc_dir, self.deps, self.eager)
+
+        # Anchor and link index for --check-links, raw HTML blocks included
+        links = set(el.get('href') for el in root.iter('a') if is_local_url(el.get('href')))
+        for block in self.md.htmlStash.rawHtmlBlocks:
+            if isinstance(block, str):
+                used.update(_pattern('raw_id').findall(block))
+                links.update(url for url in _pattern('raw_href').findall(block) if is_local_url(url))
+        self.ids = sorted(used)
+        self.links = sorted(links)
+
+        for pre in list(root.iter('pre')):
+            pre.insert(0, make_copy_button())
+
+        # fenced_code (and raw HTML) blocks never enter the tree, they wait in
+        # the stash as ready-made markup until the postprocessors run
+        blocks = self.md.htmlStash.rawHtmlBlocks
+        for i, block in enumerate(blocks):
+            if isinstance(block, str) and '<pre' in block:
+                if self.highlighter is not None:
+                    block = _pattern('fenced_code').sub(self.highlight_block, block)
+                blocks[i] = _PRE_TAG_RE.sub(lambda m: m.group(0) + COPY_BUTTON_HTML, block)
+
+    def highlight_block(self, m):
+        pre_attrs, lang, code_attrs, code = m.groups()
+        highlighted = self.highlighter.highlight(lang, html.unescape(code))
+        if highlighted is None:
+            return m.group(0)
+        # code-block keeps translate.js away from the token spans
+        return (f'<pre{add_class(pre_attrs, "highlight code-block")}>'
+                f'<code class="language-{lang}"{code_attrs}>{highlighted}</code></pre>')
+
+class Renderer:
+    # Builds the Markdown pipeline (and its extensions) once; reset() between
+    # documents is far cheaper than a fresh markdown.markdown() per file.
+    # Other tools can embed it:  title, html = Renderer().render(text)
+    # After render(), .toc holds the (level, id, text) of every heading.
+    # Pass a CodeHighlighter to highlight fenced code at build time and an
+    # ImageProcessor to size local images; .deps then lists the image files
+    # the page was built from. .ids and .links hold every element id and
+    # every local link of the page, .cache the files under .mdui-cache it
+    # used (see collect_cache_garbage).
+    # Documents of SECTION_SPLIT_MIN_SIZE and up are rendered per section
+    # (split_sections) and memoised by section text, in memory and, given a
+    # section_cache directory, on disk: editing one paragraph of a huge
+    # page re-renders one section.
+
+    def __init__(self, extensions=None, highlighter=None, images=None, section_cache=None):
+        markdown = import_markdown()
+        self.extensions = list(MARKDOWN_EXTENSIONS if extensions is None else extensions)
+        self.md = markdown.Markdown(extensions=self.extensions)
+        self.mdui = MduiTreeprocessor(self.md, highlighter, images)
+        # after inline patterns and unescaping, so heading text is final
+        self.md.treeprocessors.register(self.mdui, 'mdui', -10)
+        self.section_cache = section_cache
+        self.section_memo = {}
+        self.section_key = json.dumps([
+            SECTION_CACHE_VERSION, markdown.__version__, self.extensions,
+            highlighter.pygments.__version__ if highlighter else None,
+            images.widths if images else None])
+        self.toc = []
+        self.deps = {}
+        self.ids = []
+        self.links = []
+        self.cache = []
+
+    def reset(self):
+        self.md.reset()
+
+    def render(self, text, path=None):
+        # Returns (title, html); title is the text of the first <h1> or None.
+        # path is the source file, relative image links are resolved from it.
+        doc_dir = os.path.dirname(path) if path else '.'
+        sections = split_sections(text) if len(text) >= SECTION_SPLIT_MIN_SIZE else [text]
+        if len(sections) == 1:
+            part = self.convert(text, doc_dir)
+            self.toc, self.deps = part['toc'], part['deps']
+            self.ids, self.links = part['ids'], part['links']
+            self.cache = part['cache']
+            return part['title'], part['html']
+        # only the first image of the whole page loads eagerly
+        self.cache = []
+        parts = []
+        eager = True
+        for section in sections:
+            parts.append(self.render_section(section, doc_dir, eager))
+            eager = eager and not parts[-1]['images']
+        return self.splice(parts)
+
+    def convert(self, text, doc_dir, eager=True):
+        self.reset()
+        self.mdui.doc_dir = doc_dir
+        self.mdui.eager = eager
+        self.mdui.image_count = 0
+        highlighter, images = self.mdui.highlighter, self.mdui.images
+        if highlighter is not None:
+            highlighter.used.clear()
+        if images is not None:
+            images.used.clear()
+        content = self.md.convert(text)
+        m = self.mdui
+        cache = []
+        if highlighter is not None and highlighter.cache_dir:
+            cache += [f'{HIGHLIGHT_DIR_NAME}/{key[:2]}/{key}.html' for key in sorted(highlighter.used)]
+        if images is not None and images.cache_dir:
+            cache += [f'{IMAGE_CACHE_DIR_NAME}/{key[:2]}/{key}.json' for key in sorted(images.used)]
+        return {'html': content, 'title': m.title, 'toc': m.toc, 'deps': m.deps,
+                'ids': m.ids, 'links': m.links, 'explicit': m.explicit, 'auto': m.auto,
+                'images': m.image_count, 'cache': cache}
+
+    def render_section(self, text, doc_dir, eager=True):
+        key = hashlib.sha256(
+            f'{self.section_key}\0{doc_dir}\0{eager:d}\0{text}'.encode('utf-8')).hexdigest()
+        part = self.section_memo.get(key)
+        path = None
+        if self.section_cache:
+            path = os.path.join(self.section_cache, key[:2], key + '.json')
+            if part is None:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        part = json.load(f)
+                    part['toc'] = [tuple(entry) for entry in part['toc']]
+                    part['auto'] = [tuple(entry) for entry in part['auto']]
+                except (OSError, ValueError):
+                    part = None
+        if part is not None and part['deps'] and not deps_unchanged(self.mdui.images.root, part['deps']):
+            part = None  # an image it was sized from changed
+        if part is None:
+            part = self.convert(text, doc_dir, eager)
+            if path:
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    _write_file(path, json.dumps(part, ensure_ascii=False).encode('utf-8'))
+                except OSError:
+                    pass  # the cache is only an optimisation
+        if len(self.section_memo) >= SECTION_MEMO_SIZE:
+            self.section_memo.clear()
+        self.section_memo[key] = part
+        if path:
+            self.cache.append(f'{SECTIONS_DIR_NAME}/{key[:2]}/{key}.json')
+        self.cache.extend(part['cache'])
+        return part
+
+    def splice(self, parts):
+        # Joins separately rendered sections. Heading ids are re-assigned
+        # over the whole document in order, exactly as a single render
+        # would, and renamed in the section markup where they differ.
+        used = set()
+        for part in parts:
+            used.update(part['explicit'])
+        title = None
+        chunks = []
+        self.toc, self.deps, ids, links = [], {}, set(), set()
+        for part in parts:
+            renames = {}
+            for anchor, base in part['auto']:
+                new = unique_id(base, used)
+                if new != anchor:
+                    renames[anchor] = new
+            content = part['html']
+            if renames:
+                content = _pattern('id_attr').sub(
+                    lambda m: f'id="{renames.get(m.group(1), m.group(1))}"', content)
+            if content:
+                chunks.append(content)
+            if title is None:
+                title = part['title']
+            self.toc.extend((level, renames.get(anchor, anchor), text)
+                            for level, anchor, text in part['toc'])
+            self.deps.update(part['deps'])
+            ids.update(renames.get(anchor, anchor) for anchor in part['ids'])
+            links.update(part['links'])
+        self.ids = sorted(ids)
+        self.links = sorted(links)
+        return title, '\n'.join(chunks)
+
+_renderers = {}
+
+def get_renderer(options=None):
+    # One renderer per process (and highlight/image setting); pool workers
+    # each build their own on first use
+    options = options or BuildOptions()
+    highlight = (options.highlight_cache,) if options.highlight else None
+    images = (options.site_root, options.image_cache, options.image_widths) if options.images else None
+    key = (highlight, images, options.section_cache)
+    renderer = _renderers.get(key)
+    if renderer is None:
+        renderer = _renderers[key] = Renderer(
+            highlighter=CodeHighlighter(*highlight) if highlight else None,
+            images=ImageProcessor(options.site_root or '.', *images[1:]) if images else None,
+            section_cache=options.section_cache)
+    return renderer
+
+class BuildOptions:
+    # Page output settings shared by the whole build; part of the config hash.
+    # (A plain class rather than a dataclass: dataclasses pulls in inspect,
+    # which is a noticeable part of start-up time.)
+
+    def __init__(self, external_assets=False, asset_urls=None, minify=False,
+                 compress=(), gzip_level=9, brotli_quality=11, highlight=False,
+                 highlight_style='default', highlight_dark_style='monokai',
+                 highlight_cache=None, search=False, images=False, image_widths=(),
+                 image_cache=None, site_root=None, section_cache=None,
+                 service_worker=False, sitemap=False, feed=False, listings=False,
+                 base_url=None):
+        self.external_assets = external_assets
+        # Filled in by write_assets(): {'css': '/assets/site.<hash>.css', 'js': ...}
+        self.asset_urls = asset_urls
+        self.minify = minify
+        # Precompressed siblings ('gzip' -> .gz, 'br' -> .br) for static hosts
+        self.compress = tuple(compress)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        # Build-time Pygments highlighting; the styles only change the CSS
+        self.highlight = highlight
+        self.highlight_style = highlight_style
+        self.highlight_dark_style = highlight_dark_style
+        # Filled in by prepare_build(): <root>/.mdui-cache/highlight
+        self.highlight_cache = highlight_cache
+        # Sharded search index under search/ plus the search box in the appbar
+        self.search = search
+        # width/height and lazy loading for local images; image_widths adds
+        # a srcset of downscaled copies (needs Pillow)
+        self.images = images
+        self.image_widths = tuple(sorted(image_widths))
+        # Filled in by prepare_build()
+        self.image_cache = image_cache
+        self.site_root = site_root
+        self.section_cache = section_cache
+        # Register /sw.js, which precaches the pages and shared assets
+        self.service_worker = service_worker
+        # Built from the page metadata index after the pages; base_url
+        # defaults to the CNAME file
+        self.sitemap = sitemap
+        self.feed = feed
+        self.listings = listings
+        self.base_url = base_url
+
+    def as_dict(self):
+        return dict(vars(self))
+
+# Options that only affect files written next to the pages (or where the
+# build keeps its caches), not the pages themselves; changing them must not
+# invalidate the manifest.
+OUTPUT_ONLY_OPTIONS = ('compress', 'gzip_level', 'brotli_quality', 'highlight_cache',
+                       'image_cache', 'site_root', 'section_cache', 'sitemap', 'feed',
+                       'listings', 'base_url')
+
+COMPRESSED_SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+
+# --jobs: sources handed to a pool worker at a time. The total is unknown
+# while the scan is still running, so this is fixed and small.
+WORK_CHUNK_SIZE = 4
+
+# --jobs 1: threads reading sources ahead of the renderer, and the cap on
+# documents between the start of their read and the end of their write,
+# which keeps memory flat however large the tree is
+PIPELINE_READERS = 4
+PIPELINE_IN_FLIGHT = 16
+
+# --watch: how long a burst of saves may keep arriving before we rebuild,
+# and how often the polling fallback rescans the tree
+WATCH_DEBOUNCE = 0.03
+WATCH_MAX_DELAY = 0.5
+WATCH_POLL_INTERVAL = 0.5
+
+# --serve: rendered pages kept in memory, and the smallest page worth gzipping
+SERVE_CACHE_SIZE = 256
+SERVE_GZIP_MIN_SIZE = 1024
+
+# Never descended into when looking for sources (hidden directories such as
+# .git, .venv or .mdui-cache are skipped anyway, like glob's '**' did)
+SCAN_SKIP_DIRS = frozenset(['node_modules', 'venv', '__pycache__', 'site-packages', 'bower_components'])
+# gitignore-style files honoured in every directory of the tree
+IGNORE_FILES = ('.gitignore', '.mduiignore')
+
+_default_mode = None
+
+def _file_mode(path):
+    # mkstemp creates 0600 files; keep the existing mode, or what a plain
+    # open() would have produced under the current umask
+    global _default_mode
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError:
+        pass
+    if _default_mode is None:
+        umask = os.umask(0)
+        os.umask(umask)
+        _default_mode = 0o666 & ~umask
+    return _default_mode
+
+def _write_file(path, data):
+    # Write to a temp file in the same directory and rename it over the
+    # target, so an interrupted build never leaves a half-written page.
+    # data is bytes or a list of byte chunks.
+    import tempfile
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix='.' + name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                f.writelines(data)
+        os.chmod(tmp_path, _file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def write_if_changed(path, data):
+    # Returns False (and leaves mtime alone) when the file already holds
+    # exactly these bytes, so rsync/CDN uploads only see real changes.
+    chunks = [data] if isinstance(data, bytes) else data
+    try:
+        if os.path.getsize(path) == sum(map(len, chunks)):
+            with open(path, 'rb') as f:
+                if all(f.read(len(chunk)) == chunk for chunk in chunks):
+                    return False
+    except OSError:
+        pass
+    _write_file(path, data)
+    return True
+
+_brotli_missing_reported = False
+
+def compress_data(data, fmt, options):
+    global _brotli_missing_reported
+    if fmt == 'gzip':
+        import gzip
+        # mtime=0 keeps the .gz byte-identical for identical input
+        return gzip.compress(data, compresslevel=options.gzip_level, mtime=0)
+    try:
+        import brotli
+    except ImportError:
+        if not _brotli_missing_reported:
+            _brotli_missing_reported = True
+            print('未安装 brotli (pip install brotli)，跳过 .br 文件')
+        return None
+    return brotli.compress(data, quality=options.brotli_quality)
+
+def write_compressed(path, data, options, only_missing=False):
+    # Returns the siblings that were (re)written
+    written = []
+    for fmt in options.compress:
+        target = path + COMPRESSED_SUFFIXES[fmt]
+        if only_missing and os.path.exists(target):
+            continue
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        packed = compress_data(data, fmt, options)
+        if packed is not None:
+            _write_file(target, packed)
+            written.append(target)
+        else:
+            _remove_file(target)  # brotli missing: better none than a stale one
+    return written
+
+def remove_stale_siblings(path, options):
+    # path was just rewritten: siblings in the formats this build does not
+    # write describe the old bytes, and a static host would serve them
+    for fmt, suffix in COMPRESSED_SUFFIXES.items():
+        if fmt not in options.compress:
+            _remove_file(path + suffix)
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+_CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACE_RE = re.compile(r'\s*([{};,])\s*|(:)\s+')
+# Blocks whose contents must survive byte for byte (or get their own minifier),
+# plus comments; IE conditional comments carry markup and are kept.
+_HTML_PROTECTED_RE = re.compile(
+    r'<!--(?!\[if)(?:.*?)-->'
+    r'|<!--\[if.*?<!\[endif\]-->'
+    r'|<(pre|code|textarea|script|style)\b[^>]*>.*?</\1\s*>',
+    re.S | re.I)
+_HTML_BLOCK_TAGS = ('html|head|body|div|p|ul|ol|li|h[1-6]|table|thead|tbody|tr|th|td|'
+                    'meta|link|title|blockquote|dl|dt|dd|hr|br|!DOCTYPE')
+_HTML_BLOCK_SPACE_RE = re.compile(r'\s*(</?(?:' + _HTML_BLOCK_TAGS + r')\b[^>]*>)\s*', re.I)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def minify_css(text):
+    text = _CSS_COMMENT_RE.sub('', text)
+    text = _WHITESPACE_RE.sub(' ', text)
+    text = _CSS_SPACE_RE.sub(lambda m: m.group(1) or m.group(2), text)
+    return text.replace(';}', '}').strip()
+
+def minify_js(text):
+    # Deliberately conservative: no tokenizer, so only indentation, blank
+    # lines and whole-line // comments go. Newlines stay to keep ASI intact.
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines)
+
+def minify_html(text):
+    protected = []
+
+    def protect(m):
+        block = m.group(0)
+        if block.startswith('<!--'):
+            if not block.startswith('<!--[if'):
+                return ''
+        else:
+            tag = m.group(1).lower()
+            if tag in ('script', 'style'):
+                open_end = block.index('>') + 1
+                close_start = block.rindex('<')
+                body = block[open_end:close_start]
+                body = minify_js(body) if tag == 'script' else minify_css(body)
+                block = block[:open_end] + body + block[close_start:]
+        protected.append(block)
+        return f'\x00{len(protected) - 1}\x00'
+
+    text = _HTML_PROTECTED_RE.sub(protect, text)
+    text = _WHITESPACE_RE.sub(' ', text)
+    text = _HTML_BLOCK_SPACE_RE.sub(r'\1', text)
+    return re.sub('\x00([0-9]+)\x00', lambda m: protected[int(m.group(1))], text).strip()
+
+def asset_files(options):
+    # (ext, file name, bytes) of the shared CSS/JS for --external-assets
+    for ext, text in (('css', site_css(options)), ('js', site_js(options))):
+        if options.minify:
+            text = minify_css(text) if ext == 'css' else minify_js(text)
+        data = text.encode('utf-8')
+        yield ext, f'site.{hashlib.sha256(data).hexdigest()[:10]}.{ext}', data
+
+def write_assets(root, options, manifest):
+    # The file name carries the content hash, so an existing file is always
+    # current and the URLs can be served with immutable cache headers.
+    # Files of earlier builds are left for update_stale_outputs().
+    urls = {}
+    for ext, name, data in asset_files(options):
+        path = os.path.join(root, ASSETS_DIR_NAME, name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_file(path, data)
+            print(f'已生成: {path}')
+        write_compressed(path, data, options, only_missing=True)
+        record_output(manifest, root, path, data)
+        urls[ext] = f'/{ASSETS_DIR_NAME}/{name}'
+    return urls
+
+@functools.lru_cache(maxsize=None)
+def highlight_css(style, dark_style):
+    # Token colours for .highlight blocks, the dark style scoped under the
+    # MDUI dark layout class. Pygments' own pre/linenos rules are dropped.
+    import_pygments()
+    from pygments.formatters import HtmlFormatter
+    lines = []
+    for name, scope in ((style, '.highlight'), (dark_style, '.mdui-theme-layout-dark .highlight')):
+        defs = HtmlFormatter(style=name).get_style_defs(scope)
+        lines.extend('        ' + line for line in defs.splitlines() if line.startswith(scope))
+    return '\n'.join(lines) + '\n'
+
+def site_css(options):
+    css = SITE_CSS
+    if options.search:
+        css += SEARCH_CSS
+    if options.highlight:
+        css += highlight_css(options.highlight_style, options.highlight_dark_style)
+    return css
+
+def site_js(options):
+    js = SITE_JS + SEARCH_JS if options.search else SITE_JS
+    return js + SW_REGISTER_JS if options.service_worker else js
+
+def asset_tags(options, layout='default'):
+    if not options.asset_urls:
+        tags = {'styles': '<style>' + site_css(options) + '    </style>',
+                'scripts': '<script>' + site_js(options) + '    </script>'}
+    else:
+        tags = {'styles': f'<link rel="stylesheet" href="{options.asset_urls["css"]}">',
+                'scripts': f'<script src="{options.asset_urls["js"]}"></script>'}
+    if layout == 'light':
+        js = LIGHT_JS + SW_REGISTER_JS if options.service_worker else LIGHT_JS
+        tags['scripts'] = '<script>' + js + '    </script>'
+    return tags
+
+def render_page(text, input_path, renderer, options, timings=None):
+    # Markdown source -> (title, content HTML, raw size, page as a list of
+    # str pieces); nothing is written. Per-stage seconds go into timings.
+    timings = {} if timings is None else timings
+    # front matter and layout lookup count as rendering; 'read' is the
+    # file I/O and decoding done by read_source
+    start = time.perf_counter()
+    meta, body = parse_front_matter(text)
+    layout_name = str(meta.get('layout') or 'default')
+    layout = get_layout(layout_name)
     
-    title = os.path.basename(input_path).replace('.md', '')
+    title, content = renderer.render(body, input_path)
+    start = _lap(timings, 'render', start)
+    if meta.get('title'):
+        title = str(meta['title'])
+    elif title is None:
+        title = os.path.basename(input_path).replace('.md', '')
     
-    h1 = soup.find('h1')
-    title = h1.text if h1 else os.path.basename(input_path).replace('.md', '')
+    values = asset_tags(options, layout_name)
+    values.update(title=html.escape(title, quote=False), head=head_tags(meta),
+                  toc=toc_html(renderer.toc), content=content,
+                  search=SEARCH_HTML if options.search else '')
+    pieces = layout.render(values)
+    start = _lap(timings, 'template', start)
+    raw_size = None
+    if options.minify:
+        raw_size = sum(len(piece.encode('utf-8')) for piece in pieces)
+        pieces = [minify_html(''.join(pieces))]
+        start = _lap(timings, 'minify', start)
+    return title, content, raw_size, pieces
+
+def convert_markdown_file(input_path, renderer=None, options=None, stats=None,
+                          compressed=None):
+    # stats, if given, receives byte counts: 'source', 'raw_size' (before
+    # minification) and 'size' (written), the 'output' hash, the hash the
+    # compressed siblings were made from ('compressed'), whether the file
+    # on disk actually 'changed', and per-stage seconds in 'time'. Siblings
+    # are only redone when the page bytes differ from the given compressed
+    # hash.
+    options = options or BuildOptions()
+    renderer = renderer or get_renderer(options)
+    timings = {}
+    text = read_source(input_path, timings)
+    page = render_source(text, input_path, renderer, options, timings,
+                         index=stats is not None and options.search)
+    return write_page(page, options, stats, compressed)
+
+# The three stages of convert_markdown_file, run one after the other there
+# and overlapped by _run_pipeline: only render_source needs the renderer.
+
+def read_source(input_path, timings):
+    start = time.perf_counter()
+    with open(input_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    _lap(timings, 'read', start)
+    return text
+
+def render_source(text, input_path, renderer, options, timings, index=False):
+    # -> page dict for write_page; index adds the search terms
+    title, content, raw_size, pieces = render_page(text, input_path, renderer, options, timings)
+    start = time.perf_counter()
+    chunks = [piece.encode('utf-8') for piece in pieces]
+    size = sum(map(len, chunks))
+    page = {'output_path': input_path.replace('.md', '.html'), 'chunks': chunks,
+            'source': len(text.encode('utf-8')), 'raw_size': size if raw_size is None else raw_size,
+            'size': size, 'deps': renderer.deps, 'ids': renderer.ids, 'links': renderer.links,
+            'cache': sorted(set(renderer.cache)), 'title': title, 'time': timings}
+    _lap(timings, 'write', start)
+    if index:
+        # tokenized here so the work is spread over the pool workers
+        start = time.perf_counter()
+        terms = search_terms(title, weight=SEARCH_TITLE_WEIGHT)
+        page['terms'] = search_terms(page_text(content), terms)
+        _lap(timings, 'index', start)
+    return page
+
+def write_page(page, options, stats=None, compressed=None):
+    timings = page['time']
+    start = time.perf_counter()
+    chunks = page.pop('chunks')
+    output_path = page['output_path']
+    changed = write_if_changed(output_path, chunks)
+    start = _lap(timings, 'write', start)
     
-    full_html = HTML_TEMPLATE.format(
-        title=title,
-        content=str(soup)
-    )
+    h = hashlib.sha256()
+    for chunk in chunks:
+        h.update(chunk)
+    output_hash = h.hexdigest()
+    if changed:
+        remove_stale_siblings(output_path, options)
+    if options.compress:
+        write_compressed(output_path, b''.join(chunks), options,
+                         only_missing=output_hash == compressed)
+        compressed = output_hash
+        start = _lap(timings, 'compress', start)
+    elif changed:
+        compressed = None
     
-    output_path = input_path.replace('.md', '.html')
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(full_html)
+    if stats is not None:
+        for name in ('source', 'raw_size', 'size', 'deps', 'ids', 'links', 'cache', 'terms',
+                     'title', 'time'):
+            if name in page:
+                stats[name] = page[name]
+        stats['output'] = output_hash
+        stats['compressed'] = compressed
+        stats['changed'] = changed
     
-    print(f'已转换: {input_path} -> {output_path}')
+    return output_path
+
+def _lap(timings, stage, start):
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
+
+def _glob_to_regex(pattern):
+    # gitignore flavoured glob: '*' and '?' stop at '/', '**' crosses it
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) != -1:
+            j = pattern.find(']', i + 2)
+            body = pattern[i + 1:j]
+            if body[0] in '!^':
+                body = '^' + body[1:]
+            out.append('[' + body.replace('\\', '\\\\') + ']')
+            i = j + 1
+        elif pattern[i] == '\\' and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(out)
+
+def parse_ignore_patterns(lines):
+    # -> [(regex, negate, dir_only)], matched against paths relative to the
+    # directory the patterns came from
+    rules = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.endswith('\\ '):
+            line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line[:2] in ('\\#', '\\!'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+        anchored = '/' in line
+        regex = _glob_to_regex(line.lstrip('/'))
+        if not anchored:
+            regex = '(?:.*/)?' + regex
+        rules.append((re.compile(regex), negate, dir_only))
+    return rules
+
+class SourceScanner:
+    # Lazily walks root with os.scandir. Hidden and dependency directories
+    # plus anything matched by .gitignore / .mduiignore are pruned before
+    # descending, so a .git or node_modules tree is never listed.
+
+    def __init__(self, root, include=(), exclude=(), suffix='.md'):
+        self.root = os.path.abspath(root)
+        self.suffix = suffix
+        self.include = [(regex, dir_only) for regex, _, dir_only in parse_ignore_patterns(include)]
+        self.exclude = parse_ignore_patterns(exclude)
+        self.filtered = bool(self.include or self.exclude)
+        self._rules = {}
+
+    def _relpath(self, path):
+        rel = os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+        return '' if rel == '.' else rel
+
+    def _dir_rules(self, rel_dir):
+        rules = self._rules.get(rel_dir)
+        if rules is None:
+            rules = []
+            directory = os.path.join(self.root, rel_dir)
+            for name in IGNORE_FILES:
+                try:
+                    with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                        rules += parse_ignore_patterns(f)
+                except (OSError, UnicodeDecodeError):
+                    pass
+            self._rules[rel_dir] = rules
+        return rules
+
+    def forget_rules(self, path):
+        # the ignore file at path changed (watch mode)
+        self._rules.pop(self._relpath(os.path.dirname(path)), None)
+
+    def reload(self):
+        self._rules.clear()
+
+    @staticmethod
+    def _matches(rules, rel, is_dir):
+        matched = False
+        for regex, negate, dir_only in rules:
+            if (is_dir or not dir_only) and regex.fullmatch(rel):
+                matched = not negate
+        return matched
+
+    def _pruned(self, rel, is_dir, stack):
+        name = rel.rsplit('/', 1)[-1]
+        if name.startswith('.') or (is_dir and name in SCAN_SKIP_DIRS):
+            return True
+        ignored = False
+        for base, rules in stack:
+            sub = rel[len(base) + 1:] if base else rel
+            for regex, negate, dir_only in rules:
+                if (is_dir or not dir_only) and regex.fullmatch(sub):
+                    ignored = not negate
+        return ignored or self._matches(self.exclude, rel, is_dir)
+
+    def _wanted(self, rel):
+        if not rel.endswith(self.suffix):
+            return False
+        if not self.include:
+            return True
+        # as in gitignore, a pattern matching a directory takes in all of it
+        parents = rel.split('/')[:-1]
+        dirs = ['/'.join(parents[:i]) for i in range(1, len(parents) + 1)]
+        for regex, dir_only in self.include:
+            if not dir_only and regex.fullmatch(rel):
+                return True
+            if any(regex.fullmatch(d) for d in dirs):
+                return True
+        return False
+
+    def _stack(self, rel_dir):
+        stack = [('', self._dir_rules(''))]
+        if rel_dir:
+            parts = rel_dir.split('/')
+            for i in range(1, len(parts) + 1):
+                base = '/'.join(parts[:i])
+                stack.append((base, self._dir_rules(base)))
+        return stack
+
+    def is_pruned(self, path, is_dir=False):
+        # path or one of its directories is hidden, skipped, ignored or
+        # excluded; unlike is_ignored this holds for any kind of file
+        rel = self._relpath(path)
+        if rel.startswith('../'):
+            return True
+        if not rel:
+            return False
+        parts = rel.split('/')
+        for i in range(1, len(parts)):
+            if self._pruned('/'.join(parts[:i]), True, self._stack('/'.join(parts[:i - 1]))):
+                return True
+        return self._pruned(rel, is_dir, self._stack('/'.join(parts[:-1])))
+
+    def is_ignored(self, path, is_dir=False):
+        rel = self._relpath(path)
+        if not rel or self.is_pruned(path, is_dir):
+            return True
+        return False if is_dir else not self._wanted(rel)
+
+    def _walk(self, rel_dir, stack, want_dirs):
+        directory = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        if want_dirs:
+            yield directory
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            rel = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+            try:
+                # symlinked directories are not followed, so no loops
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if self._pruned(rel, is_dir, stack):
+                continue
+            if is_dir:
+                yield from self._walk(rel, stack + [(rel, self._dir_rules(rel))], want_dirs)
+            elif not want_dirs and self._wanted(rel):
+                yield entry.path
+
+    def files(self, top=None):
+        rel = self._relpath(top) if top else ''
+        return self._walk(rel, self._stack(rel), False)
+
+    def directories(self, top=None):
+        rel = self._relpath(top) if top else ''
+        return self._walk(rel, self._stack(rel), True)
+
+    def __iter__(self):
+        return self.files()
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def config_hash(options=None):
+    # Anything that changes the output of every page belongs here:
+    # a different template, extension list or output option invalidates
+    # the whole manifest.
+    h = hashlib.sha256()
+    for part in (HTML_TEMPLATE, LIGHT_TEMPLATE, SITE_CSS, SITE_JS, LIGHT_JS, SW_REGISTER_JS,
+                 SEARCH_CSS, SEARCH_JS, SEARCH_HTML):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    h.update(json.dumps(MARKDOWN_EXTENSIONS).encode('utf-8'))
+    h.update(f'search-{SEARCH_INDEX_VERSION}'.encode('utf-8'))
+    page_options = (options or BuildOptions()).as_dict()
+    for name in OUTPUT_ONLY_OPTIONS:
+        page_options.pop(name)
+    h.update(json.dumps(page_options, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+def manifest_path(root):
+    return os.path.join(root, CACHE_DIR_NAME, MANIFEST_NAME)
+
+def load_manifest(root):
+    try:
+        with open(manifest_path(root), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'version': MANIFEST_VERSION, 'config': None, 'files': {}}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {'version': MANIFEST_VERSION, 'config': None, 'files': {}}
+    return manifest
+
+def save_manifest(root, manifest):
+    path = manifest_path(root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    manifest = {name: value for name, value in manifest.items()
+                if name not in ('previous', 'written')}
+    _write_file(path, json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True).encode('utf-8'))
+
+def collect_cache_garbage(root, manifest):
+    # Deletes the section, highlight and image cache entries that no page
+    # in the manifest was rendered from (edited sections, removed code
+    # blocks, pages that are gone). Returns their number.
+    used = set()
+    for entry in manifest['files'].values():
+        used.update(entry.get('cache', ()))
+    cache_dir = os.path.join(root, CACHE_DIR_NAME)
+    removed = 0
+    for name in (SECTIONS_DIR_NAME, HIGHLIGHT_DIR_NAME, IMAGE_CACHE_DIR_NAME):
+        for directory, _, names in os.walk(os.path.join(cache_dir, name), topdown=False):
+            rel_dir = os.path.relpath(directory, cache_dir).replace(os.sep, '/')
+            for file_name in names:
+                if f'{rel_dir}/{file_name}' not in used:
+                    try:
+                        os.remove(os.path.join(directory, file_name))
+                        removed += 1
+                    except OSError:
+                        pass
+            try:
+                os.rmdir(directory)  # only succeeds once it is empty
+            except OSError:
+                pass
+    return removed
+
+def is_up_to_date(entry, source_hash, output_path, root='.'):
+    return (entry is not None
+            and entry.get('source') == source_hash
+            and os.path.exists(output_path)
+            and deps_unchanged(root, entry.get('deps')))
+
+def deps_unchanged(root, deps):
+    # deps: {path relative to root: [size, mtime_ns] or None if it was missing}
+    for path, stamp in (deps or {}).items():
+        try:
+            st = os.stat(os.path.join(root, path))
+        except OSError:
+            if stamp is not None:
+                return False
+            continue
+        if stamp != [st.st_size, st.st_mtime_ns]:
+            return False
+    return True
+
+def search_cache_path(root):
+    return os.path.join(root, CACHE_DIR_NAME, SEARCH_CACHE_NAME)
+
+def load_search_cache(root):
+    # {'version': 1, 'docs': {source key: {'id', 'url', 'title', 'terms': {term: tf}}}}
+    try:
+        with open(search_cache_path(root), 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get('version') != SEARCH_INDEX_VERSION:
+        return None
+    return cache
+
+def page_url(key):
+    # 'guide/index.md' -> '/guide/', 'guide/setup.md' -> '/guide/setup.html'
+    url = '/' + key.replace('.md', '.html')
+    return url[:-len('index.html')] if url.endswith('/index.html') else url
+
+def _search_postings(docs, shard=None):
+    # {shard: {term: [(id, tf), ...]}} for the given cache entries
+    shards = {}
+    for doc in docs:
+        for term, tf in doc['terms'].items():
+            name = search_shard(term)
+            if shard is None or name == shard:
+                shards.setdefault(name, {}).setdefault(term, []).append((doc['id'], tf))
+    return shards
+
+def _load_shard(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            flat = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {term: list(zip(p[::2], p[1::2])) for term, p in flat.items()}
+
+def _write_output(path, data, options):
+    changed = write_if_changed(path, data)
+    if changed:
+        remove_stale_siblings(path, options)
+    if options.compress:
+        write_compressed(path, data, options, only_missing=not changed)
+    return changed
+
+def _remove_output(path):
+    for suffix in ('',) + tuple(COMPRESSED_SUFFIXES.values()):
+        _remove_file(path + suffix)
+
+def update_search_index(root, manifest, per_file, options):
+    # Applies the pages converted in this build (per_file stats carrying
+    # 'terms') and the sources that left the manifest to search/. Only the
+    # shards holding a term of a changed page are read and rewritten; the
+    # whole index is rebuilt from the cache if search/docs.json is missing.
+    # Returns the number of shard files that changed.
+    cache = load_search_cache(root) or {'version': SEARCH_INDEX_VERSION, 'docs': {}}
+    docs = cache['docs']
+    search_dir = os.path.join(root, SEARCH_DIR_NAME)
+    docs_path = os.path.join(search_dir, 'docs.json')
+    updates = {os.path.relpath(md_file, root).replace(os.sep, '/'): stats
+               for md_file, stats in per_file.items() if 'terms' in stats}
+
+    touched = set()
+    dropped = set()
+    for key in list(docs):
+        if key in updates or key not in manifest['files']:
+            doc = docs[key] if key in updates else docs.pop(key)
+            touched.update(map(search_shard, doc['terms']))
+            dropped.add(doc['id'])
+    used = set(doc['id'] for doc in docs.values())
+    next_id = 0
+    for key, stats in updates.items():
+        doc = docs.get(key)
+        if doc is None:
+            while next_id in used:
+                next_id += 1
+            used.add(next_id)
+            doc = docs[key] = {'id': next_id}
+        doc.update(url=page_url(key), title=stats['title'], terms=stats['terms'])
+        touched.update(map(search_shard, stats['terms']))
+
+    rebuild = not os.path.exists(docs_path)
+    if rebuild:
+        additions = _search_postings(docs.values())
+        touched = set(additions)
+    else:
+        additions = _search_postings(docs[key] for key in updates)
+    os.makedirs(search_dir, exist_ok=True)
+    changed = 0
+    for shard in sorted(touched):
+        path = os.path.join(search_dir, shard + '.json')
+        postings = None if rebuild else _load_shard(path)
+        if postings is None:
+            postings = additions.get(shard) if rebuild else \
+                _search_postings(docs.values(), shard).get(shard)
+            postings = postings or {}
+        else:
+            for term in postings:
+                postings[term] = [p for p in postings[term] if p[0] not in dropped]
+            for term, entries in additions.get(shard, {}).items():
+                postings.setdefault(term, []).extend(entries)
+        flat = {term: [n for p in sorted(entries) for n in p]
+                for term, entries in postings.items() if entries}
+        if not flat:
+            _remove_output(path)
+            changed += 1
+            continue
+        data = json.dumps(flat, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+        changed += _write_output(path, data.encode('utf-8'), options)
+        record_output(manifest, root, path, data.encode('utf-8'))
+    if rebuild:
+        for name in os.listdir(search_dir):
+            if name.endswith('.json') and name != 'docs.json' and name[:-5] not in touched:
+                _remove_output(os.path.join(search_dir, name))
+
+    table = [0] * (max(used) + 1 if used else 0)
+    for doc in docs.values():
+        table[doc['id']] = [doc['url'], doc['title']]
+    data = json.dumps(table, ensure_ascii=False, separators=(',', ':'))
+    _write_output(docs_path, data.encode('utf-8'), options)
+    record_output(manifest, root, docs_path, data.encode('utf-8'))
+    # the shards this build did not touch are still part of the index
+    for name in os.listdir(search_dir):
+        if name.endswith('.json'):
+            record_output(manifest, root, os.path.join(search_dir, name))
+    os.makedirs(os.path.join(root, CACHE_DIR_NAME), exist_ok=True)
+    _write_file(search_cache_path(root),
+                json.dumps(cache, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    # A page that is up to date but missing from the index (lost or stale
+    # cache) is dropped from the manifest, so the next build renders it again
+    for key in list(manifest['files']):
+        if key not in docs:
+            del manifest['files'][key]
+    return changed
+
+def precache_manifest(root, manifest, options):
+    # ({url: hash}, {url: hash}) for sw.js: the shared asset files, the
+    # favicon and the pinned CDN files, then every page in the manifest by
+    # its output hash
+    from urllib.parse import quote
+    entries = {}
+    for url in (options.asset_urls or {}).values():
+        entries[url] = url.rsplit('.', 2)[1]  # /assets/site.<hash>.css
+    if os.path.isfile(os.path.join(root, 'favicon.png')):
+        entries['/favicon.png'] = file_hash(os.path.join(root, 'favicon.png'))[:16]
+    for url in PRECACHE_CDN_URLS:
+        entries[url] = 'pinned'
+    pages = {}
+    for key, entry in manifest['files'].items():
+        if entry.get('output'):
+            pages[quote(page_url(key), safe=_URL_PATH_SAFE)] = entry['output'][:16]
+    return entries, pages
+
+def update_service_worker(root, manifest, options):
+    # Writes <root>/sw.js with the current manifests, or without
+    # --service-worker turns an sw.js we wrote earlier into one that
+    # unregisters itself. Returns the number of precached assets and pages
+    # and whether the file changed, or None if there is nothing to do or an
+    # existing sw.js was not generated by this script.
+    path = os.path.join(root, SERVICE_WORKER_NAME)
+    try:
+        with open(path, 'rb') as f:
+            if f.readline().rstrip(b'\r\n') != SERVICE_WORKER_MARKER.encode('utf-8'):
+                return None
+    except FileNotFoundError:
+        if not options.service_worker:
+            return None
+    if not options.service_worker:
+        changed = _write_output(path, SERVICE_WORKER_RETIRE_JS.encode('utf-8'), options)
+        return {'entries': 0, 'pages': 0, 'changed': changed, 'retired': True}
+    entries, pages = precache_manifest(root, manifest, options)
+    data = SERVICE_WORKER_JS
+    for marker, value in (('/*PRECACHE*/', entries), ('/*PAGES*/', pages)):
+        data = data.replace(marker, json.dumps(
+            value, ensure_ascii=False, separators=(',', ':'), sort_keys=True))
+    changed = _write_output(path, data.encode('utf-8'), options)
+    return {'entries': len(entries), 'pages': len(pages), 'changed': changed}
+
+def page_metadata(text):
+    # Title, summary and front matter of a source without rendering it. The
+    # title is the front matter title or the first level-1 heading, the
+    # summary the description or the first paragraph, as plain text. Code,
+    # raw HTML and comments are skipped the way split_sections() skips them.
+    meta, body = parse_front_matter(text)
+    title = summary = None
+    para = []
+    in_block = False  # inside a list, quote, table or raw HTML block
+    for line, kind in block_kinds(body.splitlines()):
+        stripped = line.strip()
+        if kind is not None:
+            if para and summary is None:
+                summary = ' '.join(para)
+            para = []
+            in_block = kind == 'html'
+            continue
+        if para and _pattern('setext').match(line):
+            if title is None and stripped[0] == '=':
+                title = ' '.join(para)
+            para = []
+            continue
+        if para and stripped and (line.startswith('    ') or line.startswith('\t')):
+            para.append(stripped)  # lazy continuation
+            continue
+        heading = _pattern('atx_heading').match(line)
+        if not stripped or heading or in_block or _pattern('not_paragraph').match(line):
+            if para and summary is None:
+                summary = ' '.join(para)
+            para = []
+            if heading and title is None and len(heading.group(1)) == 1:
+                title = heading.group(2) or ''
+            in_block = bool(stripped) and not heading
+            if title is not None and summary is not None:
+                break
+            continue
+        para.append(stripped)
+    if para and summary is None:
+        summary = ' '.join(para)
+
+    if meta.get('title'):
+        title = str(meta['title'])
+    elif title is not None:
+        title = _plain_text(re.sub(r'\s*\{[^{}]*\}$', '', title))  # attr_list
+    if meta.get('description'):
+        summary = str(meta['description'])
+    summary = _plain_text(summary or '')
+    if len(summary) > SUMMARY_LENGTH:
+        summary = summary[:SUMMARY_LENGTH - 1].rstrip() + '…'
+    return {'title': title or None, 'summary': summary, 'noindex': bool(meta.get('noindex')),
+            'date': _iso_time(meta.get('updated') or meta.get('date'))}
+
+def _plain_text(text):
+    text = _pattern('md_image').sub('', text)
+    text = _pattern('md_link').sub(r'\1', text)
+    text = _pattern('md_code').sub(lambda m: m.group(2).strip(), text)
+    text = _HTML_TAG_RE.sub('', text)
+    text = _pattern('md_emphasis').sub(r'\2', _pattern('md_emphasis').sub(r'\2', text))
+    text = _pattern('md_escape').sub(r'\1', text)
+    return html.unescape(_WHITESPACE_RE.sub(' ', text)).strip()
+
+def _iso_time(value):
+    # Front matter date (YAML may already have parsed it) or a Unix time
+    # -> 'YYYY-MM-DDTHH:MM:SSZ' in UTC; None if it cannot be read
+    import datetime
+    utc = datetime.timezone.utc
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = datetime.datetime.fromtimestamp(value, utc)
+    elif isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    if not isinstance(value, datetime.datetime):
+        return None
+    value = value.replace(tzinfo=utc) if value.tzinfo is None else value.astimezone(utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def site_base_url(root, options):
+    # --base-url, else https://<host> from the CNAME file GitHub Pages uses
+    if options.base_url:
+        return options.base_url.rstrip('/')
+    try:
+        with open(os.path.join(root, 'CNAME'), 'r', encoding='utf-8') as f:
+            host = next((line.strip() for line in f if line.strip()), '')
+    except OSError:
+        return None
+    host = re.sub(r'^[a-z]+://', '', host).rstrip('/')
+    return 'https://' + host if host else None
+
+def pages_cache_path(root):
+    return os.path.join(root, CACHE_DIR_NAME, PAGES_CACHE_NAME)
+
+def load_pages_cache(root):
+    # {'version': 1, 'config', 'listings': [dir], 'pages': {source key:
+    #  {'stamp': [size, mtime_ns], 'title', 'summary', 'noindex', 'date'}}}
+    try:
+        with open(pages_cache_path(root), 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get('version') != PAGES_INDEX_VERSION:
+        return None
+    return cache
+
+def update_site_index(root, manifest, options):
+    # Refreshes the metadata of the sources in the manifest whose size or
+    # mtime changed, then rewrites sitemap.xml / the feed / the listing
+    # pages affected by those sources. Returns what changed, or None when
+    # none of them is wanted and no listing pages are left over.
+    cache = load_pages_cache(root) or {'version': PAGES_INDEX_VERSION, 'config': None,
+                                       'listings': [], 'pages': {}}
+    if not (options.sitemap or options.feed or options.listings):
+        if not cache['listings']:
+            return None
+        # --listings was switched off: remove the pages it generated
+        removed = update_listings(root, dict(cache, pages={}), set(), False, options)
+        cache['listings'] = []
+        save_pages_cache(root, cache)
+        return {'pages': 0, 'listings': removed, 'sitemap': False, 'feed': False}
+    changed = refresh_page_metadata(root, cache, manifest['files'])
+
+    current_config = config_hash(options)  # listing pages use the templates
+    rebuild = cache['config'] != current_config
+    result = {'pages': len(changed), 'listings': 0, 'sitemap': False, 'feed': False}
+    if options.listings:
+        result['listings'] = update_listings(root, cache, changed, rebuild, options, manifest)
+        for directory in cache['listings']:
+            record_output(manifest, root, os.path.join(root, directory, 'index.html'))
+    elif cache['listings']:
+        result['listings'] = update_listings(root, dict(cache, pages={}), changed, rebuild, options)
+        cache['listings'] = []
+    if options.sitemap or options.feed:
+        base_url = site_base_url(root, options)
+        if base_url is None:
+            print(f'未找到 CNAME 文件，跳过 {SITEMAP_NAME} / {FEED_NAME} (可用 --base-url 指定网址)')
+        for name, enabled, make in ((SITEMAP_NAME, options.sitemap, sitemap_xml),
+                                    (FEED_NAME, options.feed, feed_xml)):
+            path = os.path.join(root, name)
+            if not enabled or base_url is None:
+                continue
+            if changed or result['listings'] or rebuild or not os.path.exists(path):
+                data = make(cache, base_url, root).encode('utf-8')
+                result[name.split('.')[0]] = _write_output(path, data, options)
+                if result[name.split('.')[0]]:
+                    print(f'已生成: {path}')
+                record_output(manifest, root, path, data)
+            else:
+                record_output(manifest, root, path)
+
+    cache['config'] = current_config
+    save_pages_cache(root, cache)
+    return result
+
+def refresh_page_metadata(root, cache, files):
+    # Re-reads the metadata of the sources in files ({key: manifest entry})
+    # whose size or mtime changed and forgets the pages no longer there.
+    # Returns the keys that changed.
+    pages = cache['pages']
+    changed = set(key for key in pages if key not in files)
+    for key in changed:
+        del pages[key]
+    for key, entry in files.items():
+        path = os.path.join(root, key)
+        try:
+            st = os.stat(path)
+            stamp = [st.st_size, st.st_mtime_ns]
+            if key in pages and pages[key]['stamp'] == stamp:
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                info = page_metadata(f.read())
+        except (OSError, UnicodeDecodeError):
+            continue
+        # the title the page was rendered with, when the build recorded it
+        info['title'] = (entry.get('title') or info['title']
+                         or os.path.basename(key).replace('.md', ''))
+        info['stamp'] = stamp
+        pages[key] = info
+        changed.add(key)
+    return changed
+
+def save_pages_cache(root, cache):
+    os.makedirs(os.path.join(root, CACHE_DIR_NAME), exist_ok=True)
+    _write_file(pages_cache_path(root),
+                json.dumps(cache, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+def _page_loc(base_url, url):
+    from urllib.parse import quote
+    return html.escape(base_url + quote(url, safe=_URL_PATH_SAFE))
+
+def _page_time(entry):
+    return entry['date'] or _iso_time(entry['stamp'][1] / 1e9)
+
+def sitemap_xml(cache, base_url, root):
+    # noindex pages stay out; a home page that is neither a page nor a
+    # listing (written by hand) is listed as /
+    urls = []
+    for key, entry in sorted(cache['pages'].items()):
+        if not entry['noindex']:
+            urls.append(f'  <url><loc>{_page_loc(base_url, page_url(key))}</loc>'
+                        f'<lastmod>{_page_time(entry)}</lastmod></url>')
+    for directory in cache['listings']:
+        urls.append('  <url><loc>' + _page_loc(base_url, listing_url(directory)) + '</loc></url>')
+    if ('index.md' not in cache['pages'] and '' not in cache['listings']
+            and os.path.exists(os.path.join(root, 'index.html'))):
+        urls.insert(0, '  <url><loc>' + _page_loc(base_url, '/') + '</loc></url>')
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+            + ''.join(url + '\n' for url in urls) + '</urlset>\n')
+
+def feed_xml(cache, base_url, root):
+    # Atom feed of the FEED_SIZE most recently updated pages
+    entries = sorted(((_page_time(entry), key, entry) for key, entry in cache['pages'].items()
+                      if not entry['noindex']), reverse=True)[:FEED_SIZE]
+    host = html.escape(base_url.split('://', 1)[-1])
+    home = _page_loc(base_url, '/')
+    lines = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<feed xmlns="http://www.w3.org/2005/Atom">',
+             f'  <title>{host}</title>',
+             f'  <id>{home}</id>',
+             f'  <link href="{home}"/>',
+             f'  <link rel="self" href="{_page_loc(base_url, "/" + FEED_NAME)}"/>',
+             f'  <updated>{entries[0][0] if entries else _iso_time(0)}</updated>',
+             f'  <author><name>{host}</name></author>']
+    for updated, key, entry in entries:
+        loc = _page_loc(base_url, page_url(key))
+        lines += ['  <entry>',
+                  f'    <title>{html.escape(entry["title"], quote=False)}</title>',
+                  f'    <id>{loc}</id>',
+                  f'    <link href="{loc}"/>',
+                  f'    <updated>{updated}</updated>']
+        if entry['summary']:
+            lines.append(f'    <summary>{html.escape(entry["summary"], quote=False)}</summary>')
+        lines.append('  </entry>')
+    return '\n'.join(lines + ['</feed>']) + '\n'
+
+def listing_url(directory):
+    return '/' + directory + '/' if directory else '/'
+
+def _is_listing(path):
+    try:
+        with open(path, 'rb') as f:
+            return LISTING_MARKER.encode('utf-8') in f.read(8192)
+    except OSError:
+        return False
+
+def update_listings(root, cache, changed, rebuild, options, manifest=None):
+    # Every directory holding pages but no index.md of its own gets an
+    # index.html listing its pages and subdirectories. Only the listings
+    # above a changed source are rewritten; files without LISTING_MARKER
+    # are never touched. Returns the number of files that changed.
+    written = 0
+    for action, path, data in listing_updates(root, cache, changed, rebuild, options):
+        if action == 'skip':
+            print(f'跳过 {path}: 不是由本脚本生成的列表页')
+        elif action == 'write':
+            if _write_output(path, data, options):
+                written += 1
+                print(f'已生成: {path}')
+            if manifest is not None:
+                record_output(manifest, root, path, data)
+        else:
+            _remove_output(path)
+            written += 1
+            print(f'已删除: {path}')
+    return written
+
+def listing_updates(root, cache, changed, rebuild, options):
+    # What update_listings() (and --plan) does, as (action, path, data):
+    # 'write' with the page bytes, 'delete', or 'skip' for a hand-written
+    # index.html in the way (on a rebuild). Sets cache['listings'] at the end.
+    pages = cache['pages']
+    children = {}
+    counts = {}
+    for key in pages:
+        parts = key.split('/')
+        for depth in range(len(parts)):
+            directory = '/'.join(parts[:depth])
+            counts[directory] = counts.get(directory, 0) + 1
+            child = key if depth == len(parts) - 1 else '/'.join(parts[:depth + 1])
+            children.setdefault(directory, set()).add(child)
+    wanted = set(d for d in children if (d + '/index.md' if d else 'index.md') not in pages)
+    affected = set()
+    for key in changed:
+        parts = key.split('/')
+        affected.update('/'.join(parts[:depth]) for depth in range(len(parts)))
+
+    listings = []
+    for directory in sorted(wanted):
+        path = os.path.join(root, directory, 'index.html')
+        exists = os.path.exists(path)
+        if exists and not _is_listing(path):
+            if rebuild:
+                yield 'skip', path, None
+            continue
+        listings.append(directory)
+        if exists and not rebuild and directory not in affected and directory in cache['listings']:
+            continue
+        yield 'write', path, listing_page(directory, children[directory], pages, counts, options)
+    for directory in cache['listings']:
+        path = os.path.join(root, directory, 'index.html')
+        if directory not in wanted and _is_listing(path):
+            yield 'delete', path, None
+    cache['listings'] = listings
 
-def process_all_markdown_files(directory):
+def listing_page(directory, children, pages, counts, options):
+    from urllib.parse import quote
+    items = []
+    # subdirectories first, then the pages, each by name
+    for child in sorted(children, key=lambda c: (c.endswith('.md'), c)):
+        if child.endswith('.md'):
+            url, title, text = page_url(child), pages[child]['title'], pages[child]['summary']
+        elif child + '/index.md' in pages:
+            entry = pages[child + '/index.md']
+            url, title, text = listing_url(child), entry['title'], entry['summary']
+        else:
+            url, title, text = listing_url(child), child.rsplit('/', 1)[-1], f'{counts[child]} 个页面'
+        items.append(f'            <li class="mdui-list-item"><div class="mdui-list-item-content">'
+                     f'<a class="mdui-list-item-title" href="{html.escape(quote(url, safe=_URL_PATH_SAFE))}">'
+                     f'{html.escape(title, quote=False)}</a>'
+                     f'<div class="mdui-list-item-text">{html.escape(text, quote=False)}</div></div></li>')
+    title = directory.rsplit('/', 1)[-1] if directory else '/'
+    content = (f'<h1>{html.escape(title, quote=False)}</h1>\n'
+               '        <ul class="mdui-list">\n' + '\n'.join(items) + '\n        </ul>')
+    values = asset_tags(options)
+    values.update(title=html.escape(title, quote=False), head='\n    ' + LISTING_MARKER, toc='',
+                  content=content, search=SEARCH_HTML if options.search else '')
+    text = ''.join(get_layout('default').render(values))
+    return (minify_html(text) if options.minify else text).encode('utf-8')
+
+def resolve_link(page, url):
+    # (target path relative to the site root, fragment) of a local link on
+    # the page built from source key page
+    import posixpath
+    from urllib.parse import unquote
+    path, _, fragment = url.partition('#')
+    path = unquote(path.split('?', 1)[0])
+    if not path:
+        return page.replace('.md', '.html'), unquote(fragment)
+    if path.startswith('/'):
+        target = posixpath.normpath(path.lstrip('/') or '.')
+    else:
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(page), path))
+    if path.endswith('/') or target == '.':
+        target = 'index.html' if target == '.' else target + '/index.html'
+    return target, unquote(fragment)
+
+def check_links(root, manifest):
+    # Validates the links recorded in the manifest against the recorded ids
+    # of the target page, or the file on disk for anything not built from
+    # Markdown (fragments into those are not checked). A page is only
+    # re-checked when its output or the state of one of its targets changed
+    # since the last run. Returns ([(source key, url, reason)], pages checked).
+    files = manifest['files']
+    pages = {key.replace('.md', '.html'): key for key in files}
+    page_ids = {}
+    states = {}
+
+    def canonical(target):
+        if target not in pages and os.path.isdir(os.path.join(root, target)):
+            return target + '/index.html'
+        return target
+
+    def target_state(target):
+        # What a link to target depends on: the ids of a built page, the
+        # existence of any other file (None: missing)
+        if target not in states:
+            real = canonical(target)
+            if real in pages:
+                ids = files[pages[real]].get('ids', [])
+                state = 'page:' + hashlib.sha256('\0'.join(ids).encode('utf-8')).hexdigest()[:16]
+            elif not real.startswith('../') and os.path.isfile(os.path.join(root, real)):
+                state = 'file'
+            else:
+                state = None
+            states[target] = state
+        return states[target]
+
+    try:
+        with open(os.path.join(root, CACHE_DIR_NAME, LINKS_CACHE_NAME), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+    if cached.get('version') != MANIFEST_VERSION:
+        cached = {}
+    old_pages = cached.get('pages', {})
+
+    results = {}
+    broken = []
+    checked = 0
+    for key, entry in sorted(files.items()):
+        previous = old_pages.get(key)
+        if (previous is not None and previous['output'] == entry.get('output')
+                and all(target_state(t) == state for t, state in previous['targets'].items())):
+            results[key] = previous
+        else:
+            checked += 1
+            targets = {}
+            page_broken = []
+            for url in entry.get('links', []):
+                target, fragment = resolve_link(key, url)
+                state = targets[target] = target_state(target)
+                if state is None:
+                    page_broken.append([url, '找不到目标'])
+                elif fragment and fragment != 'top' and state.startswith('page:'):
+                    real = pages[canonical(target)]
+                    if real not in page_ids:
+                        page_ids[real] = set(files[real].get('ids', []))
+                    if fragment not in page_ids[real]:
+                        page_broken.append([url, f'找不到锚点 #{fragment}'])
+            results[key] = {'output': entry.get('output'), 'targets': targets, 'broken': page_broken}
+        broken.extend((key, url, reason) for url, reason in results[key]['broken'])
+
+    os.makedirs(os.path.join(root, CACHE_DIR_NAME), exist_ok=True)
+    _write_file(os.path.join(root, CACHE_DIR_NAME, LINKS_CACHE_NAME),
+                json.dumps({'version': MANIFEST_VERSION, 'pages': results},
+                           ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    return broken, checked
+
+def check_site_links(directory):
+    # --check-links: one pass over the link index of the last build
     parent_dir = os.path.dirname(directory)
-    md_files = glob.glob(os.path.join(parent_dir, '**/*.md'), recursive=True)
-    for md_file in md_files:
+    manifest = load_manifest(parent_dir)
+    broken, checked = check_links(parent_dir, manifest)
+    for key, url, reason in broken:
+        print(f'链接失效: {key}: {url} ({reason})')
+    print(f'链接检查: {len(manifest["files"])} 个页面 (重新检查 {checked} 个)，'
+          f'{len(broken)} 个失效链接')
+    return broken
+
+def _convert_worker(item, options=None):
+    # Runs in a pool worker: never raise, report the failure back instead so
+    # one bad file cannot take down the rest of the batch.
+    md_file, compressed = item
+    stats = {}
+    try:
+        output_path = convert_markdown_file(md_file, options=options, stats=stats,
+                                            compressed=compressed)
+        return md_file, output_path, None, stats
+    except Exception as e:
+        return md_file, None, f'{type(e).__name__}: {e}', stats
+
+def prepare_build(root, options=None, force=False):
+    options = options or BuildOptions()
+    options.site_root = root
+    options.section_cache = os.path.join(root, CACHE_DIR_NAME, SECTIONS_DIR_NAME)
+    if options.highlight:
+        options.highlight_cache = os.path.join(root, CACHE_DIR_NAME, HIGHLIGHT_DIR_NAME)
+    if options.images:
+        options.image_cache = os.path.join(root, CACHE_DIR_NAME, IMAGE_CACHE_DIR_NAME)
+
+    manifest = load_manifest(root)
+    # what the last build wrote, for update_orphans(); not saved
+    manifest['previous'] = manifest['files']
+    # the site-wide files this build produces, for update_stale_outputs();
+    # not saved either
+    manifest['written'] = set()
+    if options.external_assets:
+        options.asset_urls = write_assets(root, options, manifest)
+    current_config = config_hash(options)
+    if not manifest_reusable(root, manifest, current_config, options, force):
+        # Every page has to be rendered again, but a filtered run only
+        # reaches some of them: the others keep their entry (and their
+        # place in the site-wide indexes) without a source hash, so the
+        # next build that sees them renders them.
+        manifest['files'] = {key: dict(entry, source=None)
+                             for key, entry in manifest['files'].items()}
+    manifest['config'] = current_config
+    return options, manifest
+
+def manifest_reusable(root, manifest, current_config, options, force=False):
+    if force or manifest.get('config') != current_config:
+        return False
+    # the search index can only be filled by rendering
+    return not options.search or os.path.exists(search_cache_path(root))
+
+def plan_build(root, options=None, force=False, include=(), exclude=()):
+    # What a build with these options would do to the generated files,
+    # worked out from source hashes, the config hash and the manifest alone;
+    # nothing is written. Paths are relative to root. 'change' means the
+    # page is rendered again, its bytes may still come out the same.
+    # Listing pages and the compressed siblings of every file are included.
+    options = options or BuildOptions()
+    plan = {'add': [], 'change': [], 'delete': [], 'unchanged': 0}
+    unchanged = []  # existing files the build leaves alone
+    produced = set()  # site-wide files the build writes or keeps
+    if options.external_assets:
+        options.asset_urls = {}
+        for ext, name, data in asset_files(options):
+            options.asset_urls[ext] = f'/{ASSETS_DIR_NAME}/{name}'
+            produced.add(f'{ASSETS_DIR_NAME}/{name}')
+            if not os.path.exists(os.path.join(root, ASSETS_DIR_NAME, name)):
+                plan['add'].append(f'{ASSETS_DIR_NAME}/{name}')
+            else:
+                unchanged.append(f'{ASSETS_DIR_NAME}/{name}')
+    manifest = load_manifest(root)
+    reusable = manifest_reusable(root, manifest, config_hash(options), options, force)
+    plan['config_changed'] = not reusable
+    files = manifest['files'] if reusable else {}
+    seen = set()
+    after = {}  # the manifest entries after the build, new ones empty
+    scanner = SourceScanner(root, include, exclude)
+    for md_file in scanner:
+        key = os.path.relpath(md_file, root).replace(os.sep, '/')
+        seen.add(key)
+        output_path = md_file.replace('.md', '.html')
+        output = os.path.relpath(output_path, root).replace(os.sep, '/')
+        try:
+            source_hash = file_hash(md_file)
+        except OSError as e:
+            print(f'处理 {md_file} 时出错: {str(e)}', file=sys.stderr)
+            continue
+        after[key] = {}
+        if not os.path.exists(output_path):
+            plan['add'].append(output)
+        elif is_up_to_date(files.get(key), source_hash, output_path, root):
+            plan['unchanged'] += 1
+            unchanged.append(output)
+            after[key] = files[key]
+        else:
+            plan['change'].append(output)
+    known = known_outputs(manifest, manifest['files'])
+    if scanner.filtered:
+        # the build keeps the entries of sources outside the filters
+        kept = [key for key in manifest['files'] if scanner.is_ignored(os.path.join(root, key))]
+        seen.update(kept)
+        after.update((key, manifest['files'][key]) for key in kept)
+    plan['delete'] = [os.path.relpath(path, root).replace(os.sep, '/') for _, _, path in
+                      orphaned_outputs(root, known, seen)]
+
+    outputs = manifest.get('outputs') or {}
+    if options.search:
+        produced.update(rel for rel in outputs if rel.startswith(SEARCH_DIR_NAME + '/'))
+    if (options.sitemap or options.feed) and site_base_url(root, options) is not None:
+        produced.update(name for name, enabled in ((SITEMAP_NAME, options.sitemap),
+                                                   (FEED_NAME, options.feed)) if enabled)
+    listing_deletes = []  # removed by every build, not just with --prune
+    cache = load_pages_cache(root)
+    if options.listings or (cache and cache['listings']):
+        # same decisions as update_site_index(), on a copy of its cache
+        cache = cache or {'version': PAGES_INDEX_VERSION, 'config': None,
+                          'listings': [], 'pages': {}}
+        changed = refresh_page_metadata(root, cache, after)
+        rebuild = cache['config'] != config_hash(options)
+        if not options.listings:
+            cache = dict(cache, pages={})
+        for action, path, data in listing_updates(root, cache, changed, rebuild, options):
+            rel = os.path.relpath(path, root).replace(os.sep, '/')
+            if action == 'delete':
+                listing_deletes.append(rel)
+            elif action == 'write':
+                try:
+                    with open(path, 'rb') as f:
+                        if f.read() != data:
+                            plan['change'].append(rel)
+                except FileNotFoundError:
+                    plan['add'].append(rel)
+        produced.update((directory + '/' if directory else '') + 'index.html'
+                        for directory in cache['listings'])
+        produced.update(listing_deletes)
+    # outputs of options that were switched off, superseded assets
+    plan['delete'] += [rel for rel, _, _ in stale_outputs(root, outputs, produced)]
+    plan['orphans'] = len(plan['delete'])  # only deleted with --prune
+    plan['delete'] += listing_deletes
+
+    # compressed siblings: written next to every file with --compress,
+    # removed along with their file either way
+    suffixes = [COMPRESSED_SUFFIXES[fmt] for fmt in options.compress]
+    outputs = {name: list(plan[name]) for name in ('add', 'change', 'delete')}
+    for rel in outputs['delete']:
+        plan['delete'] += [rel + suffix for suffix in COMPRESSED_SUFFIXES.values()
+                           if os.path.exists(os.path.join(root, rel + suffix))]
+    for rel in outputs['add'] + outputs['change']:
+        for fmt, suffix in COMPRESSED_SUFFIXES.items():
+            exists = os.path.exists(os.path.join(root, rel + suffix))
+            if fmt in options.compress:
+                plan['change' if exists else 'add'].append(rel + suffix)
+            elif exists:
+                plan['delete'].append(rel + suffix)  # would be stale
+    # compression switched on for files that are otherwise up to date
+    plan['add'] += [rel + suffix for rel in unchanged for suffix in suffixes
+                    if not os.path.exists(os.path.join(root, rel + suffix))]
+    return plan
+
+def known_outputs(manifest, files):
+    # {source key: output hash} of the pages in files plus the orphans the
+    # manifest still remembers from earlier builds
+    known = dict(manifest.get('orphans') or {})
+    known.update((key, entry.get('output')) for key, entry in files.items())
+    return known
+
+def orphaned_outputs(root, known, current):
+    # (key, hash, page path) of the pages we wrote for sources that are
+    # gone. A source that still exists (failed, ignored or outside
+    # --include) keeps its page, and so does a page whose bytes no longer
+    # match the hash we recorded: it was replaced by hand.
+    for key, output_hash in sorted(known.items()):
+        md_file = os.path.join(root, key)
+        if key in current or os.path.exists(md_file):
+            continue
+        output_path = md_file.replace('.md', '.html')
+        try:
+            if file_hash(output_path) == output_hash:
+                yield key, output_hash, output_path
+        except OSError:
+            pass
+
+def update_orphans(root, manifest, prune=False):
+    # After a build: with prune, deletes the orphaned pages and their
+    # compressed siblings, otherwise keeps them in the manifest so a later
+    # --prune (or --plan) still knows about them. Returns their number.
+    orphans = list(orphaned_outputs(root, known_outputs(manifest, manifest['previous']),
+                                    manifest['files']))
+    manifest['orphans'] = {}
+    for key, output_hash, output_path in orphans:
+        if prune:
+            _remove_output(output_path)
+            print(f'已删除: {output_path}')
+        else:
+            manifest['orphans'][key] = output_hash
+    return len(orphans)
+
+def record_output(manifest, root, path, data=None):
+    # A site-wide file (not a page) this build wrote, or found current when
+    # data is None. It is remembered with the hash of its bytes so that it
+    # can be pruned like a page once no build produces it any more.
+    rel = os.path.relpath(path, root).replace(os.sep, '/')
+    outputs = manifest.setdefault('outputs', {})
+    if data is not None:
+        outputs[rel] = hashlib.sha256(data).hexdigest()
+    elif rel not in outputs:
+        try:
+            outputs[rel] = file_hash(path)
+        except OSError:
+            return
+    manifest.setdefault('written', set()).add(rel)
+
+def stale_outputs(root, outputs, current):
+    # (path relative to root, hash, path) of the recorded site-wide files
+    # not in current. As with orphaned_outputs(), a file whose bytes no
+    # longer match was replaced by hand and is left alone.
+    for rel, output_hash in sorted(outputs.items()):
+        if rel in current:
+            continue
+        path = os.path.join(root, rel)
         try:
-            convert_markdown_file(md_file)
+            if file_hash(path) == output_hash:
+                yield rel, output_hash, path
+        except OSError:
+            pass
+
+def update_stale_outputs(root, manifest, prune=False):
+    # After a full build: deletes the recorded site-wide files it did not
+    # produce (the assets of an earlier SITE_CSS, search/, sitemap.xml or
+    # feed.xml once the option is off) with prune, otherwise keeps them in
+    # the manifest for a later --prune or --plan. Returns their number.
+    outputs = manifest.get('outputs') or {}
+    written = manifest.get('written') or set()
+    stale = list(stale_outputs(root, outputs, written))
+    manifest['outputs'] = {rel: outputs[rel] for rel in written}
+    for rel, output_hash, path in stale:
+        if prune:
+            _remove_output(path)
+            print(f'已删除: {path}')
+            try:
+                os.rmdir(os.path.dirname(path))  # e.g. search/ once it is empty
+            except OSError:
+                pass
+        else:
+            manifest['outputs'][rel] = output_hash
+    return len(stale)
+
+def print_plan(plan, fmt='text'):
+    if fmt == 'json':
+        print(json.dumps(plan, ensure_ascii=False, indent=1, sort_keys=True))
+        return
+    for sign, name in (('+', 'add'), ('~', 'change'), ('-', 'delete')):
+        for path in plan[name]:
+            print(f'{sign} {path}')
+    note = ' (配置已变化，全部重新生成)' if plan['config_changed'] else ''
+    print(f'计划: 新增 {len(plan["add"])}，重新生成 {len(plan["change"])}，'
+          f'删除 {len(plan["delete"])}，未变化 {plan["unchanged"]}{note}')
+    if plan['orphans']:
+        print('使用 --prune 删除源文件已不存在的页面和不再生成的文件')
+
+def build_markdown_files(root, md_files, manifest, options, jobs=1, complete=True):
+    # Converts whatever in md_files is out of date and updates the manifest
+    # in place. md_files may be a lazy iterator (SourceScanner): conversion
+    # starts as soon as the first stale file is found. With complete=False
+    # md_files is only part of the tree (watch mode, --include/--exclude)
+    # and entries for other sources are kept; a filtered SourceScanner still
+    # drops the entries of sources it matches but no longer finds.
+    old_files = manifest['files']
+    files = {} if complete else dict(old_files)
+    pending = {}
+    failed = []
+    per_file = {}
+    counters = {'skipped': 0, 'scan': 0.0, 'hash': 0.0}
+    scanned = set()
+
+    def work_items():
+        it = iter(md_files)
+        while True:
+            start = time.perf_counter()
+            md_file = next(it, None)
+            counters['scan'] += time.perf_counter() - start
+            if md_file is None:
+                return
+            scanned.add(os.path.relpath(md_file, root).replace(os.sep, '/'))
+            start = time.perf_counter()
+            item = _check_source(root, md_file, old_files, files, pending, failed, options, counters)
+            counters['hash'] += time.perf_counter() - start
+            if item is not None:
+                if len(pending) == 1:
+                    # fail once, up front, instead of once per file
+                    import_markdown()
+                    if options.highlight:
+                        import_pygments()
+                yield item
+
+    if jobs <= 1:
+        results = _run_pipeline(work_items(), options)
+    else:
+        worker = functools.partial(_convert_worker, options=options)
+        results = _run_workers(work_items(), worker, jobs)
+    totals = _collect_results(results, pending, files, failed, options, per_file)
+
+    if not complete and isinstance(md_files, SourceScanner):
+        for key in [key for key in files if key not in scanned]:
+            if not md_files.is_ignored(os.path.join(root, key)):
+                del files[key]
+    manifest['files'] = files
+    failed_set = set(failed)
+    return {'failed': failed, 'skipped': counters['skipped'],
+            'converted': sum(1 for md_file in pending if md_file not in failed_set),
+            'totals': totals, 'stats': per_file,
+            'scan_time': counters['scan'], 'hash_time': counters['hash']}
+
+def _check_source(root, md_file, old_files, files, pending, failed, options, counters):
+    # Returns the work item for a stale source, None if it is up to date
+    key = os.path.relpath(md_file, root).replace(os.sep, '/')
+    try:
+        source_hash = file_hash(md_file)
+    except OSError as e:
+        print(f'处理 {md_file} 时出错: {str(e)}')
+        failed.append(md_file)
+        return None
+    output_path = md_file.replace('.md', '.html')
+    entry = old_files.get(key)
+    if is_up_to_date(entry, source_hash, output_path, root):
+        files[key] = entry
+        counters['skipped'] += 1
+        if options.compress:
+            # e.g. compression was just switched on for an existing tree,
+            # or the page changed in a build that ran without it
+            write_compressed(output_path, None, options,
+                             only_missing=entry.get('compressed') == entry.get('output'))
+            entry['compressed'] = entry.get('output')
+        return None
+    pending[md_file] = (key, source_hash)
+    return md_file, (entry or {}).get('compressed')
+
+def _convert_chunk(items, options=None):
+    return [_convert_worker(item, options) for item in items]
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _run_workers(items, worker, jobs):
+    # Yields worker results in submission order. With jobs > 1, items are
+    # sent to a process pool in small chunks as the scan produces them, and
+    # only a few chunks per worker are kept in flight.
+    if jobs <= 1:
+        yield from map(worker, items)
+        return
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    chunk_worker = functools.partial(_convert_chunk, **worker.keywords)
+    in_flight = deque()
+    pool = None
+    try:
+        for chunk in _chunks(items, WORK_CHUNK_SIZE):
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=jobs)
+            in_flight.append(pool.submit(chunk_worker, chunk))
+            # results come back in order no matter which worker finishes
+            # first, so the log is deterministic
+            while in_flight and (in_flight[0].done() or len(in_flight) > jobs * 4):
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def _run_pipeline(items, options):
+    # Serial builds as three overlapping stages: reader threads prefetch the
+    # sources, this thread renders, and a writer thread writes the pages;
+    # the stages hand documents over through bounded queues. Yields the
+    # same results as _convert_worker, in submission order.
+    import queue
+    import threading
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    slots = threading.Semaphore(PIPELINE_IN_FLIGHT)
+    writes = queue.Queue(PIPELINE_IN_FLIGHT)
+    results = queue.Queue()
+    reads = deque()
+
+    def read(md_file):
+        timings = {}
+        return read_source(md_file, timings), timings
+
+    def render_next():
+        (md_file, compressed), future = reads.popleft()
+        page = error = None
+        try:
+            text, timings = future.result()
+            page = render_source(text, md_file, get_renderer(options), options, timings,
+                                 index=options.search)
         except Exception as e:
-            print(f'处理 {md_file} 时出错: {str(e)}')
-            raise e
+            error = f'{type(e).__name__}: {e}'
+        writes.put((md_file, compressed, page, error))
+
+    def write():
+        while True:
+            job = writes.get()
+            if job is None:
+                return
+            md_file, compressed, page, error = job
+            stats = {}
+            output_path = None
+            if error is None:
+                try:
+                    output_path = write_page(page, options, stats, compressed)
+                except Exception as e:
+                    error = f'{type(e).__name__}: {e}'
+            results.put((md_file, output_path, error, stats))
+            slots.release()
+
+    def finished():
+        while True:
+            try:
+                yield results.get_nowait()
+            except queue.Empty:
+                return
+
+    writer = threading.Thread(target=write, name='mdui-writer', daemon=True)
+    writer.start()
+    pool = ThreadPoolExecutor(PIPELINE_READERS, thread_name_prefix='mdui-reader')
+    try:
+        for item in items:
+            # out of slots: render what has been read, or wait for the writer
+            while not slots.acquire(blocking=not reads):
+                render_next()
+            reads.append((item, pool.submit(read, item[0])))
+            while reads and reads[0][1].done():
+                render_next()
+            yield from finished()
+        while reads:
+            render_next()
+            yield from finished()
+    finally:
+        writes.put(None)
+        writer.join()
+        pool.shutdown()
+    yield from finished()
+
+def peak_rss(workers=False):
+    # Peak resident set size in bytes of this process and, with workers, of
+    # the largest finished child (the --jobs pool); None without the
+    # resource module. Children are only asked about after a pool build:
+    # the counter also covers whatever ran before an exec into Python.
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in KiB on Linux
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'workers': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+                       if workers else 0}
+
+def _update_search(root, manifest, result, options):
+    start = time.perf_counter()
+    shards = update_search_index(root, manifest, result['stats'], options)
+    return {'shards': shards, 'time': time.perf_counter() - start}
+
+def _update_site_index(root, manifest, options):
+    start = time.perf_counter()
+    result = update_site_index(root, manifest, options)
+    if result is None:
+        return None
+    result['time'] = time.perf_counter() - start
+    return result
+
+def _update_service_worker(root, manifest, options):
+    start = time.perf_counter()
+    result = update_service_worker(root, manifest, options)
+    if result is None:
+        if options.service_worker:
+            print(f'跳过 {SERVICE_WORKER_NAME}: 该文件不是由本脚本生成的')
+        return None
+    result['time'] = time.perf_counter() - start
+    return result
+
+def _print_summary(result, options):
+    totals = result['totals']
+    if result['converted']:
+        print(f'重新生成 {result["converted"]} 个文件，其中 {totals["changed"]} 个内容有变化')
+    if result['skipped']:
+        print(f'未变化，已跳过 {result["skipped"]} 个文件')
+    if options.minify and totals['raw_size']:
+        print(f'压缩: {totals["raw_size"]} -> {totals["size"]} 字节 ({_saving(totals)})')
+    if result.get('search', {}).get('shards'):
+        print(f'搜索索引: 更新 {result["search"]["shards"]} 个分片')
+    if (result.get('site_index') or {}).get('pages'):
+        print(f'页面元数据: 更新 {result["site_index"]["pages"]} 个页面')
+    service_worker = result.get('service_worker') or {}
+    if service_worker.get('retired'):
+        if service_worker['changed']:
+            print(f'Service Worker: 未启用 --service-worker，{SERVICE_WORKER_NAME} 已改为自行注销')
+    elif service_worker.get('changed'):
+        print(f'Service Worker: 预缓存 {service_worker["entries"]} 个文件，'
+              f'{service_worker["pages"]} 个页面在访问时缓存')
+    if result.get('orphans'):
+        if result['pruned']:
+            print(f'已删除 {result["orphans"]} 个源文件已不存在的页面')
+        else:
+            print(f'{result["orphans"]} 个页面的源文件已不存在，使用 --prune 删除')
+    if result.get('stale_outputs'):
+        if result['pruned']:
+            print(f'已删除 {result["stale_outputs"]} 个不再生成的文件')
+        else:
+            print(f'{result["stale_outputs"]} 个文件已不再生成，使用 --prune 删除')
+    if result.get('cache_removed'):
+        print(f'已清理 {result["cache_removed"]} 个不再使用的缓存文件')
+    if result['failed']:
+        print(f'{len(result["failed"])} 个文件转换失败')
+    rss = result.get('peak_rss')
+    if rss:
+        workers = f', 工作进程 {rss["workers"] / 2**20:.1f} MB' if rss['workers'] else ''
+        print(f'峰值内存: {rss["self"] / 2**20:.1f} MB{workers}')
+
+def process_all_markdown_files(directory, force=False, jobs=1, options=None,
+                               profile=None, profile_top=10, cprofile=None,
+                               include=(), exclude=(), prune=False):
+    # profile: write per-stage timings as JSON to this path ('-' = stdout)
+    # cprofile: also capture a cProfile of the build into this pstats file
+    # include/exclude: gitignore-style patterns relative to the site root
+    # prune: delete the pages of Markdown sources that were removed
+    build_start = time.perf_counter()
+    profiler = None
+    if cprofile:
+        import cProfile
+        if jobs > 1:
+            print('注意: cProfile 只记录主进程，工作进程的耗时不包含在内')
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    parent_dir = os.path.dirname(directory)
+    md_files = SourceScanner(parent_dir, include, exclude)
+
+    options, manifest = prepare_build(parent_dir, options, force)
+    # a filtered run only sees part of the tree, the rest of the manifest
+    # (and so search, sitemap and precache) has to survive it
+    result = build_markdown_files(parent_dir, md_files, manifest, options, jobs,
+                                  complete=not md_files.filtered)
+    result['orphans'] = update_orphans(parent_dir, manifest, prune)
+    result['pruned'] = prune
+    if options.search:
+        result['search'] = _update_search(parent_dir, manifest, result, options)
+    # also runs without the options, to remove listing pages left over
+    result['site_index'] = _update_site_index(parent_dir, manifest, options)
+    # also runs without --service-worker, to retire an sw.js we wrote before
+    result['service_worker'] = _update_service_worker(parent_dir, manifest, options)
+    result['stale_outputs'] = update_stale_outputs(parent_dir, manifest, prune)
+    save_manifest(parent_dir, manifest)
+    result['cache_removed'] = collect_cache_garbage(parent_dir, manifest)
+    result['peak_rss'] = peak_rss(jobs > 1)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(cprofile)
+        print(f'cProfile 数据已写入 {cprofile} (python -m pstats {cprofile})')
+    _print_summary(result, options)
+    if profile:
+        report = build_profile(result, parent_dir,
+                               time.perf_counter() - build_start, jobs, profile_top)
+        text = json.dumps(report, ensure_ascii=False, indent=1, sort_keys=True)
+        if profile == '-':
+            print(text)
+        else:
+            with open(profile, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+            print(f'性能数据已写入 {profile}')
+    return result['failed']
+
+def build_profile(result, root, wall_time, jobs, top=10):
+    # With jobs > 1 the stage totals are summed over workers (CPU seconds),
+    # so they can exceed the wall time.
+    stages = {}
+    byte_totals = {'source': 0, 'raw_size': 0, 'size': 0}
+    per_file = {}
+    for md_file, stats in result['stats'].items():
+        key = os.path.relpath(md_file, root).replace(os.sep, '/')
+        for stage, seconds in stats['time'].items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        for name in byte_totals:
+            byte_totals[name] += stats[name]
+        per_file[key] = {'total': sum(stats['time'].values()), 'time': stats['time'],
+                         'source': stats['source'], 'raw_size': stats['raw_size'],
+                         'size': stats['size']}
+    slowest = sorted(per_file.items(), key=lambda item: item[1]['total'], reverse=True)[:top]
+    return {
+        'wall': wall_time,
+        'jobs': jobs,
+        'scan': result['scan_time'],
+        'hash': result['hash_time'],
+        'search': result.get('search'),
+        'service_worker': result.get('service_worker'),
+        'site_index': result.get('site_index'),
+        'peak_rss': result.get('peak_rss'),
+        'converted': result['converted'],
+        'skipped': result['skipped'],
+        'failed': len(result['failed']),
+        'stages': stages,
+        'bytes': byte_totals,
+        'slowest': [dict(file=key, **info) for key, info in slowest],
+        'files': per_file,
+    }
+
+def _saving(stats):
+    return f'-{(1 - stats["size"] / stats["raw_size"]) * 100:.1f}%'
+
+def _collect_results(results, pending, files, failed, options, per_file):
+    totals = {'raw_size': 0, 'size': 0, 'changed': 0}
+    for md_file, output_path, error, stats in results:
+        if error is not None:
+            print(f'处理 {md_file} 时出错: {error}')
+            failed.append(md_file)
+            continue
+        per_file[md_file] = stats
+        key, source_hash = pending[md_file]
+        # Page weight is kept in the manifest so it can be tracked over time
+        files[key] = {'source': source_hash, 'output': stats['output'], 'size': stats['size']}
+        if stats['compressed']:
+            files[key]['compressed'] = stats['compressed']
+        if stats['deps']:
+            files[key]['deps'] = stats['deps']
+        if stats.get('cache'):
+            # the .mdui-cache entries the page was rendered from
+            files[key]['cache'] = stats['cache']
+        # the <title> of the page, for the sitemap, feed and listings
+        files[key]['title'] = stats['title']
+        # anchors and outbound links for --check-links
+        files[key]['ids'] = stats['ids']
+        files[key]['links'] = stats['links']
+        totals['raw_size'] += stats['raw_size']
+        totals['size'] += stats['size']
+        totals['changed'] += stats['changed']
+        note = '' if stats['changed'] else ' (内容相同，未写入)'
+        if options.minify:
+            files[key]['raw_size'] = stats['raw_size']
+            print(f'已转换: {md_file} -> {output_path} '
+                  f'({stats["raw_size"]} -> {stats["size"]} 字节, {_saving(stats)}){note}')
+        else:
+            print(f'已转换: {md_file} -> {output_path}{note}')
+    return totals
+
+class InotifyWatcher:
+    # Linux inotify through ctypes, so no third-party watcher is needed
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, scanner):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self._ctypes = ctypes
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.scanner = scanner
+        self.dirs = {}
+        self.overflowed = False
+        self._add_tree(None)
+
+    def _add_tree(self, top):
+        for dirpath in self.scanner.directories(top):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.MASK)
+            if wd < 0:
+                raise OSError(self._ctypes.get_errno(), f'inotify_add_watch failed for {dirpath}')
+            self.dirs[wd] = dirpath
+
+    def read(self, timeout):
+        # Changed paths seen within timeout seconds (None = wait forever)
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        buf = os.read(self.fd, 1 << 16)
+        changed = set()
+        offset = 0
+        while offset + self.EVENT.size <= len(buf):
+            wd, mask, _cookie, length = self.EVENT.unpack_from(buf, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # the kernel dropped events: nothing read so far can be trusted
+                self.overflowed = True
+                continue
+            if mask & self.IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            base = self.dirs.get(wd)
+            if base is None or not name:
+                continue
+            path = os.path.join(base, name)
+            if mask & self.IN_ISDIR:
+                if (mask & (self.IN_CREATE | self.IN_MOVED_TO)
+                        and not self.scanner.is_ignored(path, is_dir=True)):
+                    # a new (or moved in) directory may already hold pages
+                    self._add_tree(path)
+                    changed.update(self.scanner.files(path))
+                continue
+            if name in IGNORE_FILES:
+                self.scanner.forget_rules(path)
+                continue
+            changed.add(path)
+        return changed
+
+    def batches(self, debounce=WATCH_DEBOUNCE, max_delay=WATCH_MAX_DELAY):
+        # Sets of changed paths, or None after a queue overflow: events were
+        # lost and the whole tree has to be checked again
+        while True:
+            changed = self.read(None)
+            deadline = time.monotonic() + max_delay
+            # an editor save is often several events (write, rename, chmod)
+            while time.monotonic() < deadline:
+                more = self.read(debounce)
+                if not more:
+                    break
+                changed |= more
+            if self.overflowed:
+                self.overflowed = False
+                self.scanner.reload()
+                self._add_tree(None)  # directories created meanwhile
+                yield None
+            else:
+                yield changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    # Fallback for platforms (or network filesystems) without inotify
+
+    def __init__(self, scanner, interval=WATCH_POLL_INTERVAL):
+        self.scanner = scanner
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        self.scanner.reload()  # pick up edited ignore files
+        for path in self.scanner:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def batches(self):
+        while True:
+            time.sleep(self.interval)
+            snapshot = self._scan()
+            changed = set(path for path in snapshot.keys() | self.snapshot.keys()
+                          if snapshot.get(path) != self.snapshot.get(path))
+            self.snapshot = snapshot
+            if changed:
+                yield changed
+
+    def close(self):
+        pass
+
+def make_watcher(scanner, poll=False):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(scanner)
+        except OSError as e:
+            print(f'inotify 不可用 ({e})，改为轮询')
+    return PollingWatcher(scanner)
+
+def _dependents(root, manifest, paths):
+    # Sources whose pages were built from one of paths (e.g. an edited image)
+    deps = set(os.path.relpath(path, root).replace(os.sep, '/')
+               for path in paths if not path.endswith('.md'))
+    if not deps:
+        return set()
+    return set(os.path.join(root, key) for key, entry in manifest['files'].items()
+               if deps.intersection(entry.get('deps', ())))
+
+def watch_markdown_files(directory, options=None, jobs=1, poll=False, include=(), exclude=(),
+                         prune=False):
+    parent_dir = os.path.dirname(directory)
+    scanner = SourceScanner(parent_dir, include, exclude)
+
+    options, manifest = prepare_build(parent_dir, options)
+    result = build_markdown_files(parent_dir, scanner, manifest, options, jobs,
+                                  complete=not scanner.filtered)
+    result['orphans'] = update_orphans(parent_dir, manifest, prune)
+    result['pruned'] = prune
+    if options.search:
+        result['search'] = _update_search(parent_dir, manifest, result, options)
+    # also runs without the options, to remove listing pages left over
+    result['site_index'] = _update_site_index(parent_dir, manifest, options)
+    # also runs without --service-worker, to retire an sw.js we wrote before
+    result['service_worker'] = _update_service_worker(parent_dir, manifest, options)
+    result['stale_outputs'] = update_stale_outputs(parent_dir, manifest, prune)
+    save_manifest(parent_dir, manifest)
+    result['cache_removed'] = collect_cache_garbage(parent_dir, manifest)
+    result['peak_rss'] = peak_rss(jobs > 1)
+    _print_summary(result, options)
+
+    watcher = make_watcher(scanner, poll)
+    get_renderer(options)  # build the Markdown pipeline now, not on the first save
+    print(f'正在监视 {parent_dir} ({type(watcher).__name__})，按 Ctrl+C 退出')
+    try:
+        for changed in watcher.batches():
+            if changed is None:
+                print('文件事件队列溢出，重新检查整个目录')
+                changed = set(scanner) | set(os.path.join(parent_dir, key)
+                                             for key in manifest['files'])
+            changed = sorted(set(path for path in changed
+                                 if path.endswith('.md') and not scanner.is_ignored(path))
+                             | _dependents(parent_dir, manifest, changed))
+            if not changed:
+                continue
+            start = time.perf_counter()
+            manifest['previous'] = dict(manifest['files'])
+            for path in changed:
+                if not os.path.isfile(path):
+                    key = os.path.relpath(path, parent_dir).replace(os.sep, '/')
+                    if manifest['files'].pop(key, None) is not None and not prune:
+                        print(f'源文件已删除: {path} (页面已保留，使用 --prune 删除)')
+            present = [path for path in changed if os.path.isfile(path)]
+            # serial on purpose: the warm in-process renderer beats pool start-up
+            result = build_markdown_files(parent_dir, present, manifest, options, complete=False)
+            update_orphans(parent_dir, manifest, prune)
+            if options.search:
+                _update_search(parent_dir, manifest, result, options)
+            if options.sitemap or options.feed or options.listings:
+                _update_site_index(parent_dir, manifest, options)
+            if options.service_worker:
+                _update_service_worker(parent_dir, manifest, options)
+            save_manifest(parent_dir, manifest)
+            if result['converted'] or result['failed']:
+                print(f'重新生成 {result["converted"]} 个文件，'
+                      f'耗时 {(time.perf_counter() - start) * 1000:.0f} ms')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+class PageCache:
+    # LRU of pages rendered by --serve, keyed by source path. An entry is
+    # reused while the source keeps its size and mtime, or its content hash
+    # if only the mtime moved (a touch, a checkout), and while the images
+    # the page was sized from are unchanged.
+
+    def __init__(self, root, maxsize=SERVE_CACHE_SIZE):
+        import threading
+        from collections import OrderedDict
+        self.root = root
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, st):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+            self.entries.move_to_end(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        if entry['stamp'] != stamp:
+            if entry['stamp'][0] != st.st_size or file_hash(path) != entry['source']:
+                return None
+            entry['stamp'] = stamp
+        if not deps_unchanged(self.root, entry['deps']):
+            return None
+        return entry
+
+    def put(self, path, entry):
+        with self.lock:
+            self.entries[path] = entry
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+def _accepts_gzip(header):
+    for item in (header or '').split(','):
+        name, _, params = item.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def _etag_matches(header, etag):
+    tags = [tag.strip() for tag in (header or '').split(',')]
+    return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+def serve_markdown_files(directory, options=None, bind='127.0.0.1', port=8000,
+                         include=(), exclude=()):
+    # Serves the site and renders a page from its Markdown source only when
+    # it is requested ('/guide/' and '/guide/index.html' -> guide/index.md);
+    # nothing is written next to the sources. Everything else is served
+    # from disk as is.
+    import io
+    import threading
+    import http.server
+    from urllib.parse import urlsplit
+    parent_dir = os.path.dirname(directory)
+    scanner = SourceScanner(parent_dir, include, exclude)
+    options = options or BuildOptions()
+    options.service_worker = False  # a cache-first worker would hide edits
+    options, _ = prepare_build(parent_dir, options)
+    cache = PageCache(parent_dir)
+    render_lock = threading.Lock()  # one Markdown instance, shared by all threads
+
+    def render(md_file):
+        entry = cache.get(md_file, os.stat(md_file))
+        if entry is not None:
+            return entry
+        with render_lock:
+            st = os.stat(md_file)
+            entry = cache.get(md_file, st)  # rendered while we waited
+            if entry is not None:
+                return entry
+            start = time.perf_counter()
+            with open(md_file, 'rb') as f:
+                data = f.read()
+            renderer = get_renderer(options)
+            pieces = render_page(data.decode('utf-8'), md_file, renderer, options)[3]
+            body = ''.join(pieces).encode('utf-8')
+            entry = {'stamp': [st.st_size, st.st_mtime_ns],
+                     'source': hashlib.sha256(data).hexdigest(), 'deps': renderer.deps,
+                     'body': body, 'etag': hashlib.sha256(body).hexdigest()[:32], 'gzip': None}
+            cache.put(md_file, entry)
+            print(f'已渲染: {md_file} ({(time.perf_counter() - start) * 1000:.0f} ms)')
+            return entry
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=parent_dir, **kwargs)
+
+        def source_for(self):
+            path = urlsplit(self.path).path
+            if path.endswith('/'):
+                path += 'index.html'
+            if not path.endswith('.html'):
+                return None
+            md_file = self.translate_path(path[:-len('.html')] + '.md')
+            if not os.path.isfile(md_file) or scanner.is_ignored(md_file):
+                return None
+            return md_file
+
+        def send_head(self):
+            # .git, .mdui-cache and whatever the ignore files leave out are
+            # not part of the site
+            path = self.translate_path(urlsplit(self.path).path)
+            if scanner.is_pruned(path, os.path.isdir(path)):
+                self.send_error(404)
+                return None
+            md_file = self.source_for()
+            if md_file is None:
+                return super().send_head()
+            try:
+                entry = render(md_file)
+            except Exception as e:
+                self.send_error(500, f'{type(e).__name__}: {e}')
+                return None
+            body, etag = entry['body'], f'"{entry["etag"]}"'
+            if len(body) >= SERVE_GZIP_MIN_SIZE and _accepts_gzip(self.headers.get('Accept-Encoding')):
+                if entry['gzip'] is None:
+                    entry['gzip'] = compress_data(body, 'gzip', options)
+                body, etag = entry['gzip'], f'"{entry["etag"]}-gzip"'
+                encoding = 'gzip'
+            else:
+                encoding = None
+            status = 304 if _etag_matches(self.headers.get('If-None-Match'), etag) else 200
+            self.send_response(status)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Cache-Control', 'no-cache')
+            if status == 304:
+                self.end_headers()
+                return None
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.end_headers()
+            return io.BytesIO(body)
+
+    server = http.server.ThreadingHTTPServer((bind, port), Handler)
+    print(f'预览服务器: http://{bind}:{server.server_address[1]}/ ，按 Ctrl+C 退出')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert Markdown files to MDUI styled HTML. Unchanged files are skipped '
+                    'using the build manifest in .mdui-cache/.',
+        epilog='Pages may start with YAML (---) or TOML (+++) front matter: title overrides '
+               'the first heading, description and noindex: true become meta tags, and '
+               'layout: light drops the MDUI and translate.js scripts.')
+    parser.add_argument('--force', action='store_true',
+                        help='ignore the build manifest and rebuild every file')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='convert with N worker processes (0 = one per CPU)')
+    parser.add_argument('--external-assets', action='store_true',
+                        help='link the site CSS/JS as shared, content-hashed files under assets/')
+    parser.add_argument('--minify', action='store_true',
+                        help='minify markup, inline CSS and inline JS (<pre>/<code> are kept as is)')
+    parser.add_argument('--compress', default='', metavar='FORMATS',
+                        help='write precompressed siblings, comma separated: gzip,br '
+                             '(br needs the brotli package)')
+    parser.add_argument('--gzip-level', type=int, default=9, choices=range(1, 10), metavar='1-9',
+                        help='gzip compression level (default: 9)')
+    parser.add_argument('--brotli-quality', type=int, default=11, choices=range(0, 12), metavar='0-11',
+                        help='Brotli quality (default: 11)')
+    parser.add_argument('--highlight', action='store_true',
+                        help='highlight fenced code with Pygments at build time '
+                             '(cached in .mdui-cache/highlight/)')
+    parser.add_argument('--highlight-style', default='default', metavar='STYLE',
+                        help='Pygments style for the light theme (default: default)')
+    parser.add_argument('--highlight-dark-style', default='monokai', metavar='STYLE',
+                        help='Pygments style for the dark theme (default: monokai)')
+    parser.add_argument('--images', action='store_true',
+                        help='add width/height (read from the file header), lazy loading and '
+                             'async decoding to local images')
+    parser.add_argument('--image-widths', default='', metavar='WIDTHS',
+                        help='with --images, also write downscaled copies to assets/img/ for '
+                             'srcset, e.g. 480,960 (needs Pillow)')
+    parser.add_argument('--check-links', action='store_true',
+                        help='after the build, check local links and #anchors between pages')
+    parser.add_argument('--search', action='store_true',
+                        help='build a sharded search index under search/ and add a search box; '
+                             'only the shards a changed page touches are rewritten')
+    parser.add_argument('--sitemap', action='store_true',
+                        help='write sitemap.xml (needs a CNAME file or --base-url); '
+                             'noindex pages are left out')
+    parser.add_argument('--feed', action='store_true',
+                        help='write an Atom feed of the recently updated pages to feed.xml')
+    parser.add_argument('--listings', action='store_true',
+                        help='write an index.html listing for directories without an index.md '
+                             '(a hand-written index.html is never replaced)')
+    parser.add_argument('--base-url', metavar='URL',
+                        help='site URL for --sitemap/--feed (default: https:// + the CNAME file)')
+    parser.add_argument('--service-worker', action='store_true',
+                        help='write and register sw.js: shared assets are precached, pages cached '
+                             'when visited (best with --external-assets); without it an sw.js '
+                             'written earlier is replaced by one that unregisters itself')
+    parser.add_argument('--include', action='append', default=[], metavar='PATTERN',
+                        help='only convert sources matching this gitignore-style pattern '
+                             '(repeatable); .gitignore and .mduiignore are always honoured')
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='skip sources matching this gitignore-style pattern (repeatable)')
+    parser.add_argument('--plan', nargs='?', const='text', choices=('text', 'json'),
+                        help='only report which files a build would add, regenerate or delete, '
+                             'as text or json; nothing is written')
+    parser.add_argument('--prune', action='store_true',
+                        help='delete generated pages whose Markdown source was removed and '
+                             'generated files no longer produced, such as superseded assets or '
+                             'search/ after dropping --search (unless edited by hand since)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and rebuild Markdown files as they change (inotify on Linux)')
+    parser.add_argument('--serve', action='store_true',
+                        help='serve the site, rendering pages from Markdown when they are requested '
+                             '(LRU page cache, gzip, ETags)')
+    parser.add_argument('--bind', default='127.0.0.1', metavar='ADDRESS',
+                        help='with --serve, address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='with --serve, port to listen on (default: 8000)')
+    parser.add_argument('--poll', action='store_true',
+                        help='with --watch, poll the tree instead of using inotify')
+    parser.add_argument('--profile', metavar='FILE',
+                        help="write per-file and per-stage timings as JSON ('-' for stdout)")
+    parser.add_argument('--profile-top', type=int, default=10, metavar='N',
+                        help='number of slowest files listed in the profile')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='capture a cProfile of the build into FILE (pstats format)')
+    args = parser.parse_args(argv)
+    compress = tuple(fmt.strip() for fmt in args.compress.split(',') if fmt.strip())
+    for fmt in compress:
+        if fmt not in COMPRESSED_SUFFIXES:
+            parser.error(f'unknown compression format: {fmt}')
+    try:
+        image_widths = tuple(int(w) for w in args.image_widths.split(',') if w.strip())
+    except ValueError:
+        parser.error(f'invalid --image-widths: {args.image_widths}')
+    if any(w <= 0 for w in image_widths):
+        parser.error(f'invalid --image-widths: {args.image_widths}')
+    options = BuildOptions(external_assets=args.external_assets, minify=args.minify,
+                           compress=compress, gzip_level=args.gzip_level,
+                           brotli_quality=args.brotli_quality, highlight=args.highlight,
+                           highlight_style=args.highlight_style,
+                           highlight_dark_style=args.highlight_dark_style, search=args.search,
+                           images=args.images or bool(image_widths), image_widths=image_widths,
+                           service_worker=args.service_worker, sitemap=args.sitemap,
+                           feed=args.feed, listings=args.listings, base_url=args.base_url)
+    if args.highlight:
+        try:
+            highlight_css(args.highlight_style, args.highlight_dark_style)
+        except DependencyError as e:
+            print(e, file=sys.stderr)
+            return 2
+        except ValueError as e:  # pygments.util.ClassNotFound
+            parser.error(f'unknown Pygments style: {e}')
 
-if __name__ == '__main__':
     current_dir = os.path.dirname(os.path.abspath(__file__))
     # print(f'Current directory: {current_dir}')
-    process_all_markdown_files(current_dir)
-    print('所有 Markdown 文件处理完成！')
\ No newline at end of file
+    try:
+        if args.plan:
+            plan = plan_build(os.path.dirname(current_dir), options, force=args.force,
+                              include=args.include, exclude=args.exclude)
+            print_plan(plan, args.plan)
+            return 0
+        if args.serve:
+            serve_markdown_files(current_dir, options=options, bind=args.bind, port=args.port,
+                                 include=args.include, exclude=args.exclude)
+            return 0
+        if args.watch:
+            watch_markdown_files(current_dir, options=options,
+                                 jobs=args.jobs or os.cpu_count() or 1, poll=args.poll,
+                                 include=args.include, exclude=args.exclude, prune=args.prune)
+            return 0
+        failed = process_all_markdown_files(current_dir, force=args.force,
+                                            jobs=args.jobs or os.cpu_count() or 1,
+                                            options=options, profile=args.profile,
+                                            profile_top=args.profile_top, cprofile=args.cprofile,
+                                            include=args.include, exclude=args.exclude,
+                                            prune=args.prune)
+    except DependencyError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if failed:
+        return 1
+    print('所有 Markdown 文件处理完成！')
+    if args.check_links and check_site_links(current_dir):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())